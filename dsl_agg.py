@@ -0,0 +1,274 @@
+import re
+from dataclasses import dataclass, replace
+from multiprocessing import current_process, get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+
+from dsl_expr import strip_name
+
+
+AGG_FUNCTIONS = ('sum', 'count', 'avg', 'min', 'max', 'count_distinct')
+
+# Abaixo disso o custo de iniciar os processos supera o ganho do paralelismo
+PARALLEL_MIN_ROWS = 1_000_000
+
+# Partições por processo: mais partições que processos equilibram grupos de tamanhos diferentes
+PARTITIONS_PER_PROCESS = 4
+
+_AGGREGATION = re.compile(
+    r'''\s*(\w+)\s*\(\s*(\*|"[^"]*"|'[^']*'|[^()]*?)\s*\)(?:\s+AS\s+("[^"]*"|'[^']*'|\w+))?\s*(,|$)''',
+    re.IGNORECASE)
+# Nome temporário da coluna de valores no count_distinct
+_VALUE = '\0valor'
+_NAME_LIST = re.compile(r'''"[^"]*"|'[^']*'|[^,]+''')
+# Sufixo da coluna que guarda o resto (compensação) de uma soma de floats
+ERR_SUFFIX = '\0resto'
+
+
+def _split(values):
+    '''Divide floats em parte alta e resto, com valor == alta + resto exatamente.
+
+    As partes altas são múltiplos de uma mesma potência de 2 e pequenas o
+    bastante para que somá-las seja exato em qualquer ordem; só os restos,
+    muito menores, acumulam arredondamento.'''
+    finite = np.abs(values[np.isfinite(values)])
+    if not len(finite):
+        return values, np.zeros_like(values)
+    # Margem de bits para que a soma de todas as partes altas não arredonde
+    exponent = np.frexp(finite.max())[1] + len(values).bit_length() + 1
+    if exponent > 1000:
+        return values, np.zeros_like(values)
+    sigma = np.ldexp(1.0, exponent)
+    with np.errstate(invalid='ignore'):
+        high = (values + sigma) - sigma
+        low = values - high
+    return high, low
+
+
+def compensated_sums(grouped, values):
+    '''Soma por grupo de uma coluna float, como (soma, resto) alinhados com grouped.size().
+
+    A soma das partes altas é exata, então o resultado final (soma + resto) não
+    depende de como as linhas foram divididas em blocos: somar bloco a bloco e
+    juntar as somas parciais dá o mesmo valor que somar tudo de uma vez.'''
+    index = grouped.size().index
+    codes = grouped.ngroup().to_numpy()
+    high, low = _split(values.to_numpy(dtype='float64', na_value=np.nan))
+    # Linhas com chave nula não entram em nenhum grupo; valores nulos são ignorados, como no pandas
+    keep = codes >= 0
+    codes, high, low = codes[keep], high[keep], low[keep]
+    high = np.where(np.isnan(high), 0.0, high)
+    low = np.where(np.isnan(low), 0.0, low)
+    return (pd.Series(np.bincount(codes, high, minlength=len(index)), index=index),
+            pd.Series(np.bincount(codes, low, minlength=len(index)), index=index))
+
+
+@dataclass(frozen=True)
+class Aggregation:
+    '''Uma função de agregação do GROUP_BY ... AGG.
+
+    Cada função guarda estados parciais por grupo (somas, contagens, conjuntos)
+    que podem ser combinados entre blocos ou partições antes do resultado final.'''
+    function: str
+    column: str = None
+    alias: str = None
+
+    @property
+    def name(self):
+        if self.alias:
+            return self.alias
+        return self.function if self.column is None else f"{self.function}_{self.column}"
+
+    def partial(self, df, grouped, index):
+        'Estados parciais desta agregação, alinhados com o índice dos grupos.'
+        if self.column is None:
+            return {'n': grouped.size()}
+        values = grouped[self.column]
+        if self.function == 'count':
+            return {'n': values.count()}
+        if self.function in ('min', 'max'):
+            return {self.function: getattr(values, self.function)()}
+        if self.function == 'count_distinct':
+            # Cópia do valor com outro nome, pois a coluna pode ser também uma das chaves
+            keys = list(index.names)
+            distinct = df[keys].assign(**{_VALUE: df[self.column]}).dropna(subset=[_VALUE]).drop_duplicates()
+            sets = distinct.groupby(keys, observed=True)[_VALUE].agg(set)
+            return {'set': sets.reindex(index).map(lambda s: s if isinstance(s, set) else set())}
+
+        dtype = df[self.column].dtype
+        if not pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+            raise TypeError(f"{self.function}({self.column}) exige uma coluna numérica")
+        if dtype.kind == 'f':
+            states = dict(zip(('sum', 'err'), compensated_sums(grouped, df[self.column])))
+        else:
+            states = {'sum': values.sum()}
+        if self.function == 'avg':
+            states['n'] = values.count()
+        return states
+
+    @staticmethod
+    def combine(grouped, states):
+        'Junta os estados parciais de vários blocos; "states" mapeia estado -> coluna.'
+        combined = {}
+        for state, column in states.items():
+            if state == 'sum' and grouped.obj[column].dtype.kind == 'f':
+                combined['sum'], err = compensated_sums(grouped, grouped.obj[column])
+                combined['err'] = err + grouped[states['err']].sum() if 'err' in states else err
+            elif state == 'err':
+                # Já somado junto com 'sum' (blocos só com inteiros não têm resto)
+                continue
+            elif state in ('sum', 'n'):
+                combined[state] = grouped[column].sum()
+            elif state in ('min', 'max'):
+                combined[state] = getattr(grouped[column], state)()
+            else:
+                combined[state] = grouped[column].agg(lambda sets: set().union(*sets))
+        return combined
+
+    def finish(self, states):
+        if self.function == 'count_distinct':
+            return states['set'].map(len).astype('int64')
+        if self.function in ('sum', 'avg'):
+            total = states['sum'] + states['err'] if 'err' in states else states['sum']
+            return total if self.function == 'sum' else total / states['n'].where(states['n'] > 0)
+        if self.column is None or self.function == 'count':
+            return states['n']
+        return states[self.function]
+
+    def __str__(self):
+        text = f"{self.function}({'*' if self.column is None else self.column})"
+        default = replace(self, alias=None).name
+        return text if self.name == default else f"{text} AS {self.name}"
+
+
+def parse_group_by(text):
+    '''Interpreta "col1, col2 [AGG func(coluna) [AS nome], ...]".
+
+    Devolve (chaves, agregações); sem AGG, agregações é None e o GROUP_BY soma
+    todas as colunas, como antes.'''
+    parts = re.split(r'(?:^|\s+)AGG\s+', text.strip(), maxsplit=1, flags=re.IGNORECASE)
+    keys = [strip_name(name) for name in _NAME_LIST.findall(parts[0]) if strip_name(name)]
+    if not keys:
+        raise ValueError("informe ao menos uma coluna de agrupamento")
+    if len(parts) == 1:
+        return keys, None
+
+    aggregations = []
+    position = 0
+    body = parts[1].strip()
+    while position < len(body):
+        match = _AGGREGATION.match(body, position)
+        if match is None:
+            raise ValueError(f"agregação inválida perto de '{body[position:]}'")
+        function = match.group(1).lower()
+        column = strip_name(match.group(2))
+        if function not in AGG_FUNCTIONS:
+            raise ValueError(f"função '{function}' desconhecida; use {', '.join(AGG_FUNCTIONS)}")
+        if column == '*':
+            if function != 'count':
+                raise ValueError(f"{function}(*) não é permitido; só count(*)")
+            column = None
+        elif not column:
+            raise ValueError(f"{function}() precisa de uma coluna")
+        alias = strip_name(match.group(3)) if match.group(3) else None
+        aggregations.append(Aggregation(function, column, alias))
+        position = match.end()
+        if match.group(4) == ',' and position >= len(body):
+            raise ValueError("agregação faltando depois da vírgula")
+    if not aggregations:
+        raise ValueError("informe ao menos uma agregação depois de AGG")
+    names = [aggregation.name for aggregation in aggregations]
+    repeated = {name for name in names if names.count(name) > 1 or name in keys}
+    if repeated:
+        raise ValueError(f"nomes de coluna repetidos no resultado: {sorted(repeated)}; use AS")
+    return keys, aggregations
+
+
+# Execução paralela
+
+def _share_column(series):
+    '''Copia uma coluna para memória compartilhada.
+
+    Números vão direto; textos e outros objetos viram códigos inteiros, e só o
+    vocabulário é enviado aos processos.'''
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        values, categories = series.cat.codes.to_numpy(), None
+    elif isinstance(dtype, np.dtype) and dtype.kind in 'biufcmM':
+        values, categories = series.to_numpy(), None
+    else:
+        values, categories = pd.factorize(series, use_na_sentinel=True)
+        categories = np.append(np.asarray(categories, dtype=object), np.nan)
+    shm = SharedMemory(create=True, size=max(values.nbytes, 1))
+    np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+    return shm, (series.name, shm.name, values.dtype, len(values), dtype, categories)
+
+
+def _attach_column(spec, start, stop):
+    'Reconstrói, no processo trabalhador, o trecho [start, stop) de uma coluna compartilhada.'
+    name, shm_name, storage, length, dtype, categories = spec
+    shm = SharedMemory(name=shm_name)
+    try:
+        values = np.ndarray((length,), dtype=storage, buffer=shm.buf)[start:stop].copy()
+    finally:
+        shm.close()
+    if isinstance(dtype, pd.CategoricalDtype):
+        return pd.Categorical.from_codes(values, dtype=dtype)
+    if categories is not None:
+        return pd.Series(categories[values], dtype=dtype)
+    return values
+
+
+def _aggregate_partition(task):
+    specs, start, stop, step = task
+    part = pd.DataFrame({spec[0]: _attach_column(spec, start, stop) for spec in specs})
+    return step.apply(part)
+
+
+def parallel_apply(df, step, keys, processes):
+    '''Executa step.apply(df) dividindo as linhas entre processos pelo hash das chaves.
+
+    Todas as linhas de um grupo caem na mesma partição, então cada processo
+    agrega suas partições por completo e basta juntar e ordenar os resultados.
+    As colunas são entregues por memória compartilhada, sem cópias via pickle;
+    o passo recebido deve aceitar processes=1 para rodar sem paralelismo.'''
+    partitions = processes * PARTITIONS_PER_PROCESS
+    codes = pd.util.hash_pandas_object(df[keys], index=False).to_numpy() % partitions
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(partitions + 1))
+
+    columns = step.columns if step.columns is not None else list(df.columns)
+    columns = [name for name in df.columns if name in set(columns)]
+    handles, specs = [], []
+    try:
+        for name in columns:
+            shm, spec = _share_column(df[name].take(order))
+            handles.append(shm)
+            specs.append(spec)
+        serial = replace(step, processes=1)
+        tasks = [(specs, int(bounds[p]), int(bounds[p + 1]), serial)
+                 for p in range(partitions) if bounds[p + 1] > bounds[p]]
+        with get_context().Pool(min(processes, len(tasks))) as pool:
+            results = pool.map(_aggregate_partition, tasks)
+    finally:
+        for shm in handles:
+            shm.close()
+            shm.unlink()
+    result = pd.concat(results, ignore_index=True)
+    return result.sort_values(keys, kind='stable').reset_index(drop=True)
+
+
+def default_processes():
+    '''Processos do GROUP_BY quando o PARALLEL não é usado: só um.
+
+    Dividir as linhas em partições (hash das chaves, ordenação e cópia para a
+    memória compartilhada) ainda custa mais que a agregação inteira em um só
+    processo, então o paralelismo só é ligado pelo comando PARALLEL.'''
+    return 1
+
+
+def can_parallelize():
+    'Processos daemon (como os do multiprocessing.Pool) não podem criar outros processos.'
+    return not current_process().daemon
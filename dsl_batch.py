@@ -0,0 +1,254 @@
+'''Executa em paralelo uma fila de jobs da DSL descrita em JSONL.
+
+Cada linha do arquivo de entrada é um job:
+
+    {"id": "milton", "script": "LOAD \\"${vendas}\\"\\nFILTER vendedor = \\"Milton\\"\\nSAVE \\"${saida}\\"",
+     "inputs": {"vendas": "vendas.csv"}, "outputs": {"saida": "milton.csv"}, "timeout": 60}
+
+O script pode vir inline ("script") ou de um arquivo .dsl ("script_file"). Os
+nomes de "inputs" e "outputs" viram variáveis ${nome} no texto do script. Cada
+job roda com um interpretador novo, e o resultado de cada um é gravado como uma
+linha JSON no arquivo de saída, na ordem em que os jobs terminam.
+
+Uso: python dsl_batch.py [requests.jsonl] [-o resultados.jsonl] [-j processos] [--timeout segundos]
+'''
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from multiprocessing import get_context
+from multiprocessing.connection import wait
+from string import Template
+
+from dsl_cache import TableCache
+from dsl_interpreter import DSLInterpreter
+
+
+DEFAULT_TIMEOUT = 300
+
+# Cache do processo trabalhador: arquivos usados por vários jobs são lidos uma vez por processo
+_worker_cache = None
+
+
+def _init_worker(cache_directory):
+    global _worker_cache
+    _worker_cache = TableCache(directory=cache_directory)
+
+
+def load_jobs(path):
+    'Lê a fila de jobs; linhas inválidas viram jobs com erro em vez de interromper a leitura.'
+    jobs = []
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+                if not isinstance(job, dict):
+                    raise ValueError("o job deve ser um objeto JSON")
+            except ValueError as e:
+                job = {'invalid': f"Linha {number} inválida: {e}"}
+            timeout = job.get('timeout', 0)
+            # bool é subclasse de int; "not >= 0" também recusa NaN
+            if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or not timeout >= 0:
+                job['invalid'] = f"Linha {number} inválida: 'timeout' deve ser um número de segundos >= 0"
+            job.setdefault('id', number)
+            jobs.append(job)
+    return jobs
+
+
+def _script_lines(job):
+    if 'script_file' in job:
+        with open(job['script_file'], encoding='utf-8') as f:
+            text = f.read()
+    elif 'script' in job:
+        text = job['script']
+    else:
+        raise ValueError("job sem 'script' nem 'script_file'")
+    variables = {}
+    for group in ('inputs', 'outputs'):
+        variables.update(job.get(group) or {})
+    return Template(text).safe_substitute(variables).splitlines()
+
+
+def _outputs(job):
+    return {name: {'path': path, 'exists': os.path.exists(path)}
+            for name, path in (job.get('outputs') or {}).items()}
+
+
+def run_job(job):
+    '''Executa um job em um interpretador isolado e devolve o resultado estruturado.
+
+    O tempo limite não é controlado aqui: quem distribui os jobs (run_batch)
+    encerra o processo que passar do limite.'''
+    started = time.perf_counter()
+    result = {'id': job['id'], 'status': 'ok', 'commands': [], 'errors': []}
+    buffer = io.StringIO()
+    interpreter = DSLInterpreter(cache=_worker_cache or TableCache(), stdout=buffer)
+
+    try:
+        if 'invalid' in job:
+            raise ValueError(job['invalid'])
+        lines = _script_lines(job)
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            start = buffer.tell()
+            command_started = time.perf_counter()
+            stop, ok = interpreter.run_line(line)
+            result['commands'].append({
+                'command': line,
+                'ok': ok,
+                'seconds': round(time.perf_counter() - command_started, 6),
+                'output': buffer.getvalue()[start:].rstrip('\n'),
+            })
+            if stop:
+                break
+    except Exception as e:
+        result['status'] = 'error'
+        result['errors'].append(f"{type(e).__name__}: {e}")
+
+    result['errors'] = interpreter.errors + result['errors']
+    if result['status'] == 'ok' and result['errors']:
+        result['status'] = 'error'
+    result['outputs'] = _outputs(job)
+    result['seconds'] = round(time.perf_counter() - started, 6)
+    return result
+
+
+def _failed(job, status, message, seconds):
+    'Resultado de um job cujo processo foi encerrado (tempo limite) ou morreu.'
+    return {'id': job['id'], 'status': status, 'commands': [], 'errors': [message],
+            'outputs': _outputs(job), 'seconds': round(seconds, 6)}
+
+
+def _worker_loop(conn, cache_directory):
+    'Processo trabalhador: recebe jobs pelo pipe e devolve os resultados, até receber None.'
+    _init_worker(cache_directory)
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        conn.send(run_job(job))
+
+
+class _Worker:
+    '''Um processo trabalhador e o job que ele está executando.
+
+    O tempo limite é cobrado daqui, do processo principal: um job que passa do
+    limite tem o processo encerrado (mesmo no meio de uma leitura do pandas, que
+    nenhum sinal interromperia) e um processo novo toma o lugar.'''
+
+    def __init__(self, context, cache_directory):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker_loop, args=(child, cache_directory))
+        self.process.start()
+        child.close()
+        self.job = None
+        self.started = self.deadline = None
+
+    def submit(self, job, timeout):
+        self.job = job
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout if timeout else None
+        self.conn.send(job)
+
+    def collect(self):
+        'Resultado do job atual; se o processo morreu sem responder, um resultado de erro.'
+        job, self.job = self.job, None
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError):
+            return _failed(job, 'error', f"O processo do job terminou inesperadamente (código {self.process.exitcode}).",
+                           time.monotonic() - self.started)
+
+    def expire(self):
+        'Encerra o processo do job que passou do tempo limite e devolve o resultado de timeout.'
+        job, self.job = self.job, None
+        self.process.terminate()
+        self.stop()
+        return _failed(job, 'timeout', f"Tempo limite de {self.deadline - self.started:g} s excedido.",
+                       time.monotonic() - self.started)
+
+    def stop(self):
+        if self.process.is_alive() and self.job is None:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+            self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+
+def run_batch(jobs_path, results_path, processes=None, timeout=DEFAULT_TIMEOUT,
+              cache_directory='.dsl_cache'):
+    'Distribui os jobs entre processos e grava um resultado JSON por linha. Devolve a contagem por status.'
+    jobs = load_jobs(jobs_path)
+    # Jobs com as mesmas entradas em sequência tendem a cair no mesmo processo e reaproveitar o cache
+    jobs.sort(key=lambda job: json.dumps(job.get('inputs') or {}, sort_keys=True))
+    queue = deque(jobs)
+    context = get_context()
+    workers = [_Worker(context, cache_directory) for _ in range(min(processes or os.cpu_count() or 1, len(jobs)))]
+    counts = {}
+    try:
+        with open(results_path, 'w', encoding='utf-8') as out:
+            while queue or any(worker.job is not None for worker in workers):
+                for worker in workers:
+                    if worker.job is None and queue:
+                        job = queue.popleft()
+                        # Um job inválido pode ter justamente o 'timeout' inválido
+                        worker.submit(job, timeout if 'invalid' in job else job.get('timeout', timeout))
+                busy = [worker for worker in workers if worker.job is not None]
+                deadlines = [worker.deadline for worker in busy if worker.deadline is not None]
+                wait_for = max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+                ready = wait([worker.conn for worker in busy] + [worker.process.sentinel for worker in busy], wait_for)
+
+                results = []
+                for position, worker in enumerate(workers):
+                    if worker.job is None:
+                        continue
+                    if worker.conn in ready or worker.process.sentinel in ready:
+                        results.append(worker.collect())
+                        if not worker.process.is_alive():
+                            worker.stop()
+                            workers[position] = _Worker(context, cache_directory)
+                    elif worker.deadline is not None and time.monotonic() >= worker.deadline:
+                        results.append(worker.expire())
+                        workers[position] = _Worker(context, cache_directory)
+                for result in results:
+                    out.write(json.dumps(result, ensure_ascii=False, default=str) + '\n')
+                    out.flush()
+                    counts[result['status']] = counts.get(result['status'], 0) + 1
+    finally:
+        for worker in workers:
+            worker.stop()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Executa uma fila de jobs da DSL em paralelo.")
+    parser.add_argument('jobs', nargs='?', default='requests.jsonl', help="arquivo JSONL com os jobs")
+    parser.add_argument('-o', '--output', default='results.jsonl', help="arquivo JSONL de resultados")
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help="número de processos (padrão: número de CPUs)")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help="tempo limite padrão por job, em segundos (0 desativa)")
+    parser.add_argument('--cache-dir', default='.dsl_cache', help="pasta do cache de tabelas em disco")
+    args = parser.parse_args(argv)
+
+    counts = run_batch(args.jobs, args.output, args.processes, args.timeout, args.cache_dir)
+    summary = ', '.join(f"{status}: {count}" for status, count in sorted(counts.items()))
+    print(f"Resultados gravados em '{args.output}' ({summary or 'nenhum job'}).", file=sys.stderr)
+    return 0 if set(counts) <= {'ok'} else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
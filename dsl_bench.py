@@ -0,0 +1,308 @@
+'''Benchmarks da DSL com dados sintéticos.
+
+Gera arquivos no formato de vendas.csv, clientes.csv e pedidos.csv e mede cada
+comando (LOAD, FILTER, SORT_BY, GROUP_BY, SHOW, JOIN, SAVE, EXPORT_JSON) com o
+PROFILE do interpretador. Cada execução vira uma linha de bench_results.jsonl,
+com a versão do código, para comparar regressões entre versões.
+
+Uso:
+    python dsl_bench.py generate --rows 1M [--dir bench_data]
+    python dsl_bench.py run --rows 1M 10M [--modes EAGER STREAM] [--repeat 3]
+    python dsl_bench.py compare [--threshold 0.1]
+'''
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+from dsl_cache import TableCache
+from dsl_interpreter import DSLInterpreter
+
+
+DEFAULT_DATA_DIR = 'bench_data'
+DEFAULT_RESULTS = 'bench_results.jsonl'
+
+# Linhas geradas por vez, para que 50M de linhas não precisem caber na memória
+GENERATE_CHUNK_ROWS = 1_000_000
+
+# Variação de tempo a partir da qual o compare aponta regressão
+DEFAULT_THRESHOLD = 0.10
+
+# Diferenças menores que isso são ruído de medição (comandos adiados nos modos LAZY e STREAM)
+MIN_REGRESSION_SECONDS = 0.05
+
+VENDEDORES = ['Aline', 'Carlos', 'Jessica', 'Milton', 'Wagner', 'Bruno', 'Daniela', 'Eduardo',
+              'Fernanda', 'Lucas', 'Marina', 'Paulo', 'Renata', 'Sérgio', 'Tatiane', 'Vitor']
+PRODUTOS = ['Notebook', 'Teclado', 'Mouse', 'Monitor', 'Cadeira', 'Headset', 'Webcam',
+            'Impressora', 'Roteador', 'Tablet']
+NOMES = ['Ana', 'Bruno', 'Carlos', 'Daniela', 'Eduardo', 'Fernanda', 'João', 'Lucas', 'Maria', 'Pedro']
+SOBRENOMES = ['Silva', 'Souza', 'Costa', 'Santos', 'Oliveira', 'Pereira', 'Lima', 'Gomes']
+CIDADES = ['São Paulo', 'Rio de Janeiro', 'Belo Horizonte', 'Porto Alegre', 'Curitiba',
+           'Fortaleza', 'Salvador', 'Recife', 'Manaus', 'Brasília']
+
+# Passos do benchmark: (rótulo, comando). Os rótulos identificam o passo entre versões.
+SUITE = [
+    ('LOAD vendas', 'LOAD "{vendas}"'),
+    ('FILTER', 'FILTER quantidade > 3'),
+    ('SORT_BY', 'SORT_BY valor DESC'),
+    ('GROUP_BY', 'GROUP_BY "vendedor" AGG sum(valor), count(*), avg(quantidade)'),
+    ('SHOW', 'SHOW'),
+    ('LOAD pedidos', 'LOAD "{pedidos}"'),
+    ('JOIN', 'JOIN "{clientes}" ON "cliente_id"'),
+    ('SAVE', 'SAVE "{saida}.csv"'),
+    ('EXPORT_JSON', 'EXPORT_JSON "{saida}.json"'),
+]
+
+
+def parse_rows(text):
+    'Converte "1M", "500K" ou "2000000" em número de linhas.'
+    text = text.strip().upper()
+    units = {'K': 1_000, 'M': 1_000_000}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def format_rows(rows):
+    if rows % 1_000_000 == 0:
+        return f"{rows // 1_000_000}M"
+    if rows % 1_000 == 0:
+        return f"{rows // 1_000}K"
+    return str(rows)
+
+
+def data_paths(directory, rows):
+    tag = format_rows(rows)
+    return {name: os.path.join(directory, f"{name}_{tag}.csv") for name in ('vendas', 'clientes', 'pedidos')}
+
+
+def _write_chunks(path, chunks):
+    tmp = path + '.tmp'
+    first = True
+    for chunk in chunks:
+        chunk.to_csv(tmp, index=False, mode='w' if first else 'a', header=first, float_format='%.2f')
+        first = False
+    os.replace(tmp, path)
+
+
+def _vendas(rows, rng):
+    for start in range(0, rows, GENERATE_CHUNK_ROWS):
+        n = min(GENERATE_CHUNK_ROWS, rows - start)
+        yield pd.DataFrame({
+            'vendedor': rng.choice(VENDEDORES, n),
+            'produto': rng.choice(PRODUTOS, n),
+            'quantidade': rng.integers(1, 11, n),
+            'valor': np.round(rng.gamma(2.0, 250.0, n), 2),
+        })
+
+
+def _clientes(count, rng):
+    for start in range(0, count, GENERATE_CHUNK_ROWS):
+        n = min(GENERATE_CHUNK_ROWS, count - start)
+        ids = np.arange(start + 1, start + n + 1)
+        nomes = pd.Series(rng.choice(NOMES, n)) + ' ' + pd.Series(rng.choice(SOBRENOMES, n))
+        yield pd.DataFrame({
+            'cliente_id': ids,
+            'nome': nomes,
+            'email': [f"cliente{i}@example.com" for i in ids],
+            'cidade': rng.choice(CIDADES, n),
+        })
+
+
+def _pedidos(rows, clientes, rng):
+    for start in range(0, rows, GENERATE_CHUNK_ROWS):
+        n = min(GENERATE_CHUNK_ROWS, rows - start)
+        yield pd.DataFrame({
+            'cliente_id': rng.integers(1, clientes + 1, n),
+            'pedido_id': np.arange(start + 1, start + n + 1),
+            'valor': np.round(rng.gamma(2.0, 100.0, n), 2),
+        })
+
+
+def generate(rows, directory=DEFAULT_DATA_DIR, seed=42, force=False):
+    '''Gera vendas e pedidos com "rows" linhas e clientes com um décimo disso.
+
+    A semente é fixa, então os mesmos arquivos saem em qualquer máquina; arquivos
+    já existentes são reaproveitados.'''
+    os.makedirs(directory, exist_ok=True)
+    paths = data_paths(directory, rows)
+    clientes = max(rows // 10, 1)
+    rng = np.random.default_rng(seed)
+    generators = {
+        'vendas': lambda: _vendas(rows, rng),
+        'clientes': lambda: _clientes(clientes, rng),
+        'pedidos': lambda: _pedidos(rows, clientes, rng),
+    }
+    for name, path in paths.items():
+        if force or not os.path.exists(path):
+            print(f"Gerando '{path}'...", file=sys.stderr)
+            _write_chunks(path, generators[name]())
+    return paths
+
+
+def code_version():
+    'Commit atual do repositório (com "-dirty" se houver alterações), ou None fora do git.'
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=here, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=here,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def run_suite(paths, mode='EAGER', output_dir=DEFAULT_DATA_DIR):
+    'Executa a suíte uma vez com PROFILE ON e devolve {rótulo: medição}.'
+    interpreter = DSLInterpreter(cache=TableCache(), stdout=io.StringIO())
+    interpreter.cache.enabled = False
+    interpreter.run_line(f"MODE {mode}")
+    interpreter.run_line('PROFILE ON')
+    saida = os.path.join(output_dir, f"saida_{mode.lower()}")
+    measured = {}
+    try:
+        for label, command in SUITE:
+            interpreter.run_line(command.format(saida=saida, **paths))
+            measured[label] = interpreter.profiler.records[-1]
+    finally:
+        interpreter.profiler.stop()
+    return measured
+
+
+def benchmark(rows, mode='EAGER', repeat=1, directory=DEFAULT_DATA_DIR):
+    'Roda a suíte "repeat" vezes; o tempo guardado é a mediana, e o menor também é registrado.'
+    paths = generate(rows, directory)
+    runs = [run_suite(paths, mode, directory) for _ in range(repeat)]
+    commands = {}
+    for label, _ in SUITE:
+        records = [run[label] for run in runs]
+        seconds = [record['seconds'] for record in records]
+        commands[label] = {
+            'command': records[0]['command'],
+            'ok': all(record['ok'] for record in records),
+            'seconds': round(statistics.median(seconds), 6),
+            'seconds_min': min(seconds),
+            'rows_in': records[0]['rows_in'],
+            'rows_out': records[0]['rows_out'],
+            'peak_memory': max(record['peak_memory'] or 0 for record in records),
+            'bytes_read': records[0]['bytes_read'],
+            'bytes_written': records[0]['bytes_written'],
+        }
+    return {
+        'version': code_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'rows': rows,
+        'mode': mode,
+        'repeat': repeat,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'cpus': os.cpu_count(),
+        'machine': platform.machine(),
+        'commands': commands,
+    }
+
+
+def load_results(path):
+    results = []
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            results = [json.loads(line) for line in f if line.strip()]
+    return results
+
+
+def compare(results, threshold=DEFAULT_THRESHOLD, baseline=None):
+    '''Compara a execução mais recente de cada (linhas, modo) com a anterior.
+
+    Com "baseline", compara com a execução mais recente daquela versão.
+    Devolve linhas (linhas, modo, passo, antes, depois, variação, regressão).'''
+    runs = {}
+    for result in results:
+        runs.setdefault((result['rows'], result['mode']), []).append(result)
+    latest, previous = {}, {}
+    for key, history in runs.items():
+        latest[key] = history[-1]
+        candidates = [result for result in history[:-1] if baseline is None or result['version'] == baseline]
+        if candidates:
+            previous[key] = candidates[-1]
+
+    rows = []
+    for key, current in sorted(latest.items()):
+        if key not in previous:
+            continue
+        before = previous[key]
+        for label, _ in SUITE:
+            if label not in before['commands'] or label not in current['commands']:
+                continue
+            old = before['commands'][label]['seconds']
+            new = current['commands'][label]['seconds']
+            change = (new - old) / old if old else 0.0
+            rows.append((format_rows(key[0]), key[1], label, before['version'], current['version'],
+                         old, new, change, change > threshold and new - old > MIN_REGRESSION_SECONDS))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks da DSL com dados sintéticos.")
+    sub = parser.add_subparsers(dest='action', required=True)
+
+    gen = sub.add_parser('generate', help="gera os arquivos sintéticos")
+    gen.add_argument('--rows', nargs='+', default=['1M'], help="linhas de vendas e pedidos (ex.: 1M 10M 50M)")
+    gen.add_argument('--dir', default=DEFAULT_DATA_DIR, help="pasta dos arquivos gerados")
+    gen.add_argument('--force', action='store_true', help="gera de novo mesmo se os arquivos existirem")
+
+    run = sub.add_parser('run', help="executa a suíte e grava os resultados")
+    run.add_argument('--rows', nargs='+', default=['1M'], help="tamanhos a medir (ex.: 1M 10M 50M)")
+    run.add_argument('--modes', nargs='+', default=['EAGER'], help="modos de execução (EAGER, LAZY, STREAM)")
+    run.add_argument('--repeat', type=int, default=3, help="repetições por tamanho e modo")
+    run.add_argument('--dir', default=DEFAULT_DATA_DIR, help="pasta dos arquivos gerados")
+    run.add_argument('-o', '--output', default=DEFAULT_RESULTS, help="arquivo JSONL de resultados")
+
+    cmp_ = sub.add_parser('compare', help="compara a última execução com a anterior")
+    cmp_.add_argument('-i', '--input', default=DEFAULT_RESULTS, help="arquivo JSONL de resultados")
+    cmp_.add_argument('--baseline', help="versão usada como referência (padrão: a execução anterior)")
+    cmp_.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                      help="variação de tempo considerada regressão (0.1 = 10%%)")
+    args = parser.parse_args(argv)
+
+    if args.action == 'generate':
+        for rows in args.rows:
+            generate(parse_rows(rows), args.dir, force=args.force)
+        return 0
+
+    if args.action == 'run':
+        failed = False
+        for rows in args.rows:
+            for mode in args.modes:
+                result = benchmark(parse_rows(rows), mode.upper(), args.repeat, args.dir)
+                with open(args.output, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(result, ensure_ascii=False) + '\n')
+                total = sum(command['seconds'] for command in result['commands'].values())
+                print(f"{format_rows(result['rows'])} {result['mode']}: {total:.3f} s", file=sys.stderr)
+                failed = failed or not all(command['ok'] for command in result['commands'].values())
+        return 1 if failed else 0
+
+    rows = compare(load_results(args.input), args.threshold, args.baseline)
+    if not rows:
+        print("Nenhuma execução anterior para comparar.", file=sys.stderr)
+        return 0
+    table = [[size, mode, label, f"{old:.3f}", f"{new:.3f}", f"{change:+.1%}", 'REGRESSÃO' if slower else '']
+             for size, mode, label, _, _, old, new, change, slower in rows]
+    print(f"Versões: {rows[0][3]} -> {rows[0][4]}")
+    print(tabulate(table, headers=['Linhas', 'Modo', 'Passo', 'Antes (s)', 'Depois (s)', 'Variação', ''],
+                   tablefmt='pretty'))
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
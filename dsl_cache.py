@@ -0,0 +1,313 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from dsl_join import indexes as join_indexes
+from dsl_types import read_csv
+
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 ** 2
+DEFAULT_DISK_BUDGET = 1024 ** 3
+DEFAULT_DIRECTORY = '.dsl_cache'
+
+# Com copy-on-write o pandas não deixa alterações vazarem entre cópias rasas
+_COPY_ON_WRITE = int(pd.__version__.split('.')[0]) >= 3 or pd.get_option('mode.copy_on_write') is True
+
+_SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(text):
+    'Converte "512M", "2G" ou um número de bytes em bytes.'
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in _SIZE_UNITS:
+        return int(float(text[:-1]) * _SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def _detach(df):
+    'Cópia que pode ser alterada sem afetar a versão guardada no cache.'
+    return df.copy(deep=not _COPY_ON_WRITE)
+
+
+class TableCache:
+    '''Cache de tabelas já lidas de arquivos CSV, em memória e em disco.
+
+    Cada entrada é identificada pelo caminho, tamanho e data de modificação do
+    arquivo e pelas opções de leitura. Se o arquivo muda, as entradas antigas
+    dele são descartadas. Em disco cada coluna é um arquivo .npy, aberto com
+    memory-map; textos são guardados como códigos inteiros mais o vocabulário.
+    As duas camadas descartam as entradas menos usadas ao passar do orçamento.'''
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, memory_budget=DEFAULT_MEMORY_BUDGET,
+                 disk_budget=DEFAULT_DISK_BUDGET):
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.enabled = True
+        # Índices dos JOINs seguem o mesmo orçamento de memória
+        join_indexes.resize(memory_budget)
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.hits = {'memoria': 0, 'disco': 0}
+        self.misses = 0
+
+    @property
+    def keeps_tables(self):
+        'Se as tabelas lidas por read_csv ficam guardadas aqui (o cache de índices dos JOINs consulta).'
+        return self.enabled
+
+    # Leitura
+    def read_csv(self, path, **options):
+        'Mesma interface de pd.read_csv (mais compact=True), servindo do cache quando possível.'
+        if 'compact' in options and not options['compact']:
+            # compact=False é a leitura normal e deve cair na mesma entrada do cache
+            del options['compact']
+        if not self.enabled or not isinstance(path, (str, os.PathLike)):
+            return read_csv(path, **options)
+
+        chunksize = options.pop('chunksize', None)
+        if options.get('nrows') is not None:
+            return read_csv(path, chunksize=chunksize, **options)
+
+        df = self.lookup(path, options)
+        if chunksize is not None:
+            if df is None:
+                return read_csv(path, chunksize=chunksize, **options)
+            return (df.iloc[start:start + chunksize] for start in range(0, len(df), chunksize))
+
+        if df is None:
+            self.misses += 1
+            df = read_csv(path, **options)
+            self.store(path, options, df)
+            df = _detach(df)
+        return df
+
+    def lookup(self, path, options):
+        'Procura a tabela no cache; uma entrada sem usecols também serve para qualquer usecols.'
+        signature = self._signature(path)
+        if signature is None:
+            return None
+        self._invalidate(signature)
+
+        candidates = [options]
+        if options.get('usecols') is not None:
+            candidates.append({k: v for k, v in options.items() if k != 'usecols'})
+        for candidate in candidates:
+            df = self._get(self._key(signature, candidate))
+            if df is not None:
+                if candidate is not options:
+                    wanted = set(options['usecols'])
+                    df = df[[c for c in df.columns if c in wanted]]
+                return _detach(df)
+        return None
+
+    def _get(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits['memoria'] += 1
+            return self.memory[key][0]
+        df = self._load_disk(key)
+        if df is not None:
+            self.hits['disco'] += 1
+            self._put_memory(key, df)
+        return df
+
+    # Escrita
+    def store(self, path, options, df):
+        signature = self._signature(path)
+        if signature is None:
+            return
+        key = self._key(signature, options)
+        self._put_memory(key, df)
+        try:
+            self._write_disk(key, signature, df)
+        except (OSError, TypeError, ValueError):
+            # O disco é só uma segunda camada; se falhar, a memória continua valendo
+            pass
+
+    def _put_memory(self, key, df):
+        size = int(df.memory_usage(deep=True).sum())
+        if key in self.memory:
+            self.memory_bytes -= self.memory.pop(key)[1]
+        if size > self.memory_budget:
+            return
+        self.memory[key] = (df, size)
+        self.memory_bytes += size
+        while self.memory_bytes > self.memory_budget:
+            _, (_, evicted) = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted
+
+    # Chaves e invalidação
+    @staticmethod
+    def _signature(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+    @staticmethod
+    def _key(signature, options):
+        options = dict(options)
+        if options.get('usecols') is not None:
+            options['usecols'] = sorted(options['usecols'])
+        text = json.dumps([signature, options], sort_keys=True, default=str)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _invalidate(self, signature):
+        'Descarta entradas do mesmo arquivo com tamanho ou data de modificação diferentes.'
+        path = signature[0]
+        for key, meta in list(self._disk_entries().items()):
+            if meta['path'] == path and (meta['size'], meta['mtime_ns']) != signature[1:]:
+                self._remove_disk(key)
+                if key in self.memory:
+                    self.memory_bytes -= self.memory.pop(key)[1]
+
+    # Disco
+    def _entry_dir(self, key):
+        return os.path.join(self.directory, key)
+
+    def _disk_entries(self):
+        entries = {}
+        if not os.path.isdir(self.directory):
+            return entries
+        for key in os.listdir(self.directory):
+            try:
+                with open(os.path.join(self._entry_dir(key), 'meta.json'), encoding='utf-8') as f:
+                    entries[key] = json.load(f)
+            except (OSError, ValueError):
+                continue
+        return entries
+
+    def _write_disk(self, key, signature, df):
+        if os.path.isdir(self._entry_dir(key)):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+        try:
+            columns = []
+            for position, name in enumerate(df.columns):
+                columns.append(self._write_column(tmp, position, df[name]))
+            meta = {
+                'path': signature[0], 'size': signature[1], 'mtime_ns': signature[2],
+                'rows': len(df), 'columns': columns,
+                'bytes': sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp)),
+            }
+            with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.rename(tmp, self._entry_dir(key))
+        except OSError:
+            # Outro processo pode ter gravado a mesma entrada primeiro
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(self._entry_dir(key)):
+                raise
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self._evict_disk()
+
+    @staticmethod
+    def _write_column(directory, position, series):
+        info = {'name': series.name, 'dtype': str(series.dtype), 'file': f"{position}.npy"}
+        if isinstance(series.dtype, np.dtype) and series.dtype.kind in 'biufcmM':
+            np.save(os.path.join(directory, info['file']), series.to_numpy())
+            return info
+        values = series.dropna()
+        if not all(isinstance(v, str) for v in values.tolist()):
+            raise TypeError(f"coluna '{series.name}' com tipos mistos")
+        codes, uniques = pd.factorize(series, use_na_sentinel=True)
+        np.save(os.path.join(directory, info['file']), codes)
+        info['categories'] = [str(v) for v in uniques]
+        return info
+
+    def _load_disk(self, key):
+        directory = self._entry_dir(key)
+        try:
+            with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            data = {}
+            for info in meta['columns']:
+                # mmap_mode='c': páginas lidas sob demanda e alterações nunca voltam ao arquivo
+                values = np.load(os.path.join(directory, info['file']), mmap_mode='c').view(np.ndarray)
+                if 'categories' in info:
+                    categories = np.array(info['categories'] + [np.nan], dtype=object)
+                    values = pd.Series(categories[values], dtype=info['dtype'])
+                data[info['name']] = values
+            os.utime(os.path.join(directory, 'meta.json'))
+        except (OSError, ValueError, KeyError):
+            return None
+        return pd.DataFrame(data, index=pd.RangeIndex(meta['rows']), copy=False)
+
+    def _remove_disk(self, key):
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def _evict_disk(self):
+        entries = self._disk_entries()
+        total = sum(meta['bytes'] for meta in entries.values())
+        by_access = sorted(entries, key=lambda key: self._last_access(key))
+        while total > self.disk_budget and by_access:
+            key = by_access.pop(0)
+            total -= entries[key]['bytes']
+            self._remove_disk(key)
+
+    def _last_access(self, key):
+        try:
+            return os.path.getmtime(os.path.join(self._entry_dir(key), 'meta.json'))
+        except OSError:
+            return time.time()
+
+    # Comandos CACHE
+    def resize(self, memory_budget, disk_budget=None):
+        'Altera os orçamentos e já descarta o que passar deles.'
+        self.memory_budget = memory_budget
+        while self.memory_bytes > self.memory_budget:
+            _, (_, evicted) = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted
+        join_indexes.resize(memory_budget)
+        if disk_budget is not None:
+            self.disk_budget = disk_budget
+            self._evict_disk()
+
+    def clear(self):
+        self.memory.clear()
+        self.memory_bytes = 0
+        join_indexes.clear()
+        self.hits = {'memoria': 0, 'disco': 0}
+        self.misses = 0
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def stats(self):
+        entries = self._disk_entries()
+        hits = sum(self.hits.values())
+        lookups = hits + self.misses
+        return {
+            'ativo': self.enabled,
+            'acertos_memoria': self.hits['memoria'],
+            'acertos_disco': self.hits['disco'],
+            'faltas': self.misses,
+            'taxa_de_acerto': hits / lookups if lookups else 0.0,
+            'entradas_memoria': len(self.memory),
+            'memoria_residente': self.memory_bytes,
+            'orcamento_memoria': self.memory_budget,
+            'entradas_disco': len(entries),
+            'disco_usado': sum(meta['bytes'] for meta in entries.values()),
+            'orcamento_disco': self.disk_budget,
+            'indices_join': len(join_indexes.entries),
+            'memoria_indices_join': join_indexes.memory_bytes,
+            'diretorio': self.directory,
+        }
@@ -0,0 +1,595 @@
+import operator
+import re
+from collections import OrderedDict
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+from dsl_types import widen
+
+
+# Operadores de comparação aceitos em FILTER e UPDATE ... WHERE
+OPERATORS = {
+    '==': operator.eq,
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<>': operator.ne,
+    '>=': operator.ge,
+    '<=': operator.le,
+    '>': operator.gt,
+    '<': operator.lt,
+}
+
+ARITHMETIC = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+}
+
+KEYWORDS = {'AND', 'OR', 'NOT', 'IN', 'BETWEEN', 'IS', 'NULL', 'WHERE'}
+
+_TOKEN = re.compile(r'''\s*(?:
+      (?P<string>"[^"]*"|'[^']*')
+    | (?P<number>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)
+    | (?P<op>==|!=|<>|>=|<=|=|<|>|[(),+*/-])
+    | (?P<word>[^\s"'(),=<>!+*/-]+)
+    )''', re.VERBOSE)
+
+
+def strip_name(token):
+    'Remove espaços e aspas de um nome de coluna ou valor.'
+    return token.strip().strip('"').strip("'")
+
+
+def parse_literal(token):
+    'Converte o texto de um valor em int, float ou string.'
+    value = strip_name(token)
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+class Token:
+    def __init__(self, kind, text, start, end):
+        self.kind = kind
+        self.text = text
+        self.start = start
+        self.end = end
+
+    def keyword(self, *names):
+        return self.kind == 'word' and self.text.upper() in names
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"Caractere inesperado na posição {position + 1}: '{text[position]}'")
+        kind = match.lastgroup
+        tokens.append(Token(kind, match.group(kind), match.start(kind), match.end(kind)))
+        position = match.end()
+    return tokens
+
+
+# Constantes
+class Literal:
+    '''Valor constante escrito no comando.
+
+    O tipo final só é decidido contra o dtype da coluna comparada: "30" vira
+    número numa coluna numérica e continua texto numa coluna de texto. A
+    conversão é feita uma vez por dtype e reaproveitada.'''
+
+    def __init__(self, text, quoted=False, negative=False):
+        self.text = text
+        self.quoted = quoted
+        self.negative = negative
+        self._coerced = {}
+
+    @property
+    def value(self):
+        'Valor sem levar em conta a coluna, como o FILTER original interpretava.'
+        value = parse_literal(self.text)
+        return -value if self.negative and not isinstance(value, str) else value
+
+    def coerce(self, dtype):
+        key = str(dtype)
+        if key not in self._coerced:
+            self._coerced[key] = self._coerce(dtype)
+        return self._coerced[key]
+
+    def _coerce(self, dtype):
+        if isinstance(dtype, pd.CategoricalDtype):
+            dtype = dtype.categories.dtype
+        kind = getattr(dtype, 'kind', 'O')
+        if kind in 'iuf':
+            value = self.value
+            if isinstance(value, str):
+                raise ValueError(f"O valor '{self.text}' não é numérico.")
+            if kind in 'iu' and isinstance(value, float) and value.is_integer():
+                value = int(value)
+            return value
+        if kind == 'b':
+            text = self.text.strip().lower()
+            if text in ('true', '1', 'sim'):
+                return True
+            if text in ('false', '0', 'não', 'nao'):
+                return False
+            raise ValueError(f"O valor '{self.text}' não é booleano.")
+        if kind == 'M':
+            return pd.Timestamp(self.text).to_datetime64()
+        return ('-' if self.negative else '') + self.text
+
+    def __str__(self):
+        text = ('-' if self.negative else '') + self.text
+        return repr(text) if self.quoted or isinstance(parse_literal(text), str) else text
+
+
+def _column(df, name):
+    if name not in df.columns:
+        raise KeyError(name)
+    return df[name]
+
+
+def _is_numpy(series):
+    return isinstance(series.dtype, np.dtype) and series.dtype.kind in 'biufmM'
+
+
+def compare(series, op, value):
+    'Máscara NumPy de "coluna op valor", com NaN tratado como no pandas.'
+    func = OPERATORS[op]
+    if _is_numpy(series):
+        values = series.to_numpy()
+        if values.dtype.kind == 'f' and values.dtype.itemsize < 8:
+            # O NumPy converteria o valor para float32 antes de comparar
+            values = values.astype('float64')
+        return func(values, value)
+    if isinstance(series.dtype, pd.CategoricalDtype) and op in ('==', '=', '!=', '<>'):
+        # Compara só as categorias e espalha o resultado pelos códigos
+        hits = np.asarray(func(series.cat.categories, value), dtype=bool)
+        codes = series.cat.codes.to_numpy()
+        return np.where(codes >= 0, hits[codes], func is operator.ne)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype(series.cat.categories.dtype)
+    return func(series, value).to_numpy(dtype=bool, na_value=func is operator.ne)
+
+
+# Nós da condição
+class Comparison:
+    'Condição simples do tipo coluna operador valor.'
+
+    def __init__(self, column, op, literal):
+        self.column = column
+        self.op = '==' if op == '=' else '!=' if op == '<>' else op
+        self.literal = literal if isinstance(literal, Literal) else Literal(str(literal))
+
+    @property
+    def value(self):
+        return self.literal.value
+
+    @property
+    def columns(self):
+        return {self.column}
+
+    def mask(self, df):
+        series = _column(df, self.column)
+        return compare(series, self.op, self.literal.coerce(series.dtype))
+
+    def __str__(self):
+        return f"{self.column} {self.op} {self.literal}"
+
+
+class InList:
+    def __init__(self, column, literals, negated=False):
+        self.column = column
+        self.literals = literals
+        self.negated = negated
+
+    @property
+    def columns(self):
+        return {self.column}
+
+    def mask(self, df):
+        series = _column(df, self.column)
+        values = [literal.coerce(series.dtype) for literal in self.literals]
+        if _is_numpy(series):
+            mask = np.isin(series.to_numpy(), np.array(values))
+        else:
+            mask = series.isin(values).to_numpy(dtype=bool)
+        return ~mask if self.negated else mask
+
+    def __str__(self):
+        values = ', '.join(str(literal) for literal in self.literals)
+        return f"{self.column} {'NOT IN' if self.negated else 'IN'} ({values})"
+
+
+class Between:
+    def __init__(self, column, low, high, negated=False):
+        self.column = column
+        self.low = low
+        self.high = high
+        self.negated = negated
+
+    @property
+    def columns(self):
+        return {self.column}
+
+    def mask(self, df):
+        series = _column(df, self.column)
+        mask = (compare(series, '>=', self.low.coerce(series.dtype))
+                & compare(series, '<=', self.high.coerce(series.dtype)))
+        return ~mask if self.negated else mask
+
+    def __str__(self):
+        return f"{self.column} {'NOT BETWEEN' if self.negated else 'BETWEEN'} {self.low} AND {self.high}"
+
+
+class IsNull:
+    def __init__(self, column, negated=False):
+        self.column = column
+        self.negated = negated
+
+    @property
+    def columns(self):
+        return {self.column}
+
+    def mask(self, df):
+        mask = _column(df, self.column).isna().to_numpy()
+        return ~mask if self.negated else mask
+
+    def __str__(self):
+        return f"{self.column} IS {'NOT NULL' if self.negated else 'NULL'}"
+
+
+class Not:
+    def __init__(self, term):
+        self.term = term
+
+    @property
+    def columns(self):
+        return self.term.columns
+
+    def mask(self, df):
+        return ~self.term.mask(df)
+
+    def __str__(self):
+        return f"NOT ({self.term})"
+
+
+class And:
+    'Várias condições combinadas com AND em uma única máscara.'
+    symbol = 'AND'
+    merge = operator.and_
+
+    def __init__(self, terms):
+        self.terms = list(terms)
+
+    @property
+    def columns(self):
+        return set().union(*(term.columns for term in self.terms))
+
+    def mask(self, df):
+        return reduce(type(self).merge, (term.mask(df) for term in self.terms))
+
+    def __str__(self):
+        return f" {self.symbol} ".join(f"({term})" for term in self.terms)
+
+
+class Or(And):
+    symbol = 'OR'
+    merge = operator.or_
+
+
+def combine(conditions):
+    'Junta uma lista de condições em uma só (AND).'
+    terms = []
+    for condition in conditions:
+        if type(condition) is And:
+            terms.extend(condition.terms)
+        else:
+            terms.append(condition)
+    return terms[0] if len(terms) == 1 else And(terms)
+
+
+def first_value(condition):
+    'Primeiro valor comparado na condição (usado no nome padrão do EXPORT_JSON).'
+    if isinstance(condition, Comparison):
+        return condition.value
+    for child in getattr(condition, 'terms', None) or [getattr(condition, 'term', None)]:
+        if child is not None:
+            value = first_value(child)
+            if value is not None:
+                return value
+    return None
+
+
+# Expressões de valor do UPDATE
+class Constant:
+    def __init__(self, value):
+        self.value = value
+
+    @property
+    def columns(self):
+        return set()
+
+    def evaluate(self, df):
+        return self.value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+class ColumnRef:
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def columns(self):
+        return {self.name}
+
+    def evaluate(self, df):
+        # Colunas compactas voltam ao tipo largo para que as contas não estourem
+        return widen(_column(df, self.name))
+
+    def __str__(self):
+        return self.name
+
+
+class BinaryOp:
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    @property
+    def columns(self):
+        return self.left.columns | self.right.columns
+
+    def evaluate(self, df):
+        return ARITHMETIC[self.op](self.left.evaluate(df), self.right.evaluate(df))
+
+    def __str__(self):
+        return f"({self.left} {self.op} {self.right})"
+
+
+def _fold(node):
+    'Calcula de uma vez as partes da expressão que não dependem de colunas.'
+    if isinstance(node, BinaryOp):
+        node.left, node.right = _fold(node.left), _fold(node.right)
+        if isinstance(node.left, Constant) and isinstance(node.right, Constant):
+            return Constant(ARITHMETIC[node.op](node.left.value, node.right.value))
+    return node
+
+
+# Parser
+class _Parser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError("Condição incompleta.")
+        self.position += 1
+        return token
+
+    def accept_op(self, *ops):
+        token = self.peek()
+        if token is not None and token.kind == 'op' and token.text in ops:
+            self.position += 1
+            return token
+        return None
+
+    def accept_keyword(self, *names):
+        token = self.peek()
+        if token is not None and token.keyword(*names):
+            self.position += 1
+            return token
+        return None
+
+    def expect_keyword(self, name):
+        if not self.accept_keyword(name):
+            raise ValueError(f"Esperado {name} na condição.")
+
+    def done(self):
+        token = self.peek()
+        if token is not None:
+            raise ValueError(f"Trecho inesperado na condição: '{self.text[token.start:]}'")
+
+    # condição := ou ; ou := e (OR e)* ; e := não (AND não)* ; não := NOT não | primário
+    def condition(self):
+        terms = [self.conjunction()]
+        while self.accept_keyword('OR'):
+            terms.append(self.conjunction())
+        return terms[0] if len(terms) == 1 else Or(terms)
+
+    def conjunction(self):
+        terms = [self.negation()]
+        while self.accept_keyword('AND'):
+            terms.append(self.negation())
+        return terms[0] if len(terms) == 1 else And(terms)
+
+    def negation(self):
+        if self.accept_keyword('NOT'):
+            return Not(self.negation())
+        if self.accept_op('('):
+            node = self.condition()
+            if not self.accept_op(')'):
+                raise ValueError("Parêntese não fechado na condição.")
+            return node
+        return self.predicate()
+
+    def column_name(self):
+        token = self.next()
+        if token.kind not in ('word', 'string') or token.keyword(*KEYWORDS):
+            raise ValueError(f"Esperado nome de coluna, encontrado '{token.text}'.")
+        return strip_name(token.text)
+
+    def predicate(self):
+        column = self.column_name()
+        if self.accept_keyword('IS'):
+            negated = bool(self.accept_keyword('NOT'))
+            self.expect_keyword('NULL')
+            return IsNull(column, negated)
+        negated = bool(self.accept_keyword('NOT'))
+        if self.accept_keyword('IN'):
+            if not self.accept_op('('):
+                raise ValueError("Esperado '(' depois de IN.")
+            literals = [self.literal()]
+            while self.accept_op(','):
+                literals.append(self.literal())
+            if not self.accept_op(')'):
+                raise ValueError("Lista do IN não fechada.")
+            return InList(column, literals, negated)
+        if self.accept_keyword('BETWEEN'):
+            low = self.literal()
+            self.expect_keyword('AND')
+            return Between(column, low, self.literal(), negated)
+        if negated:
+            raise ValueError("NOT deve vir antes de IN ou BETWEEN.")
+        token = self.next()
+        if token.kind != 'op' or token.text not in OPERATORS:
+            raise ValueError("Operador inválido. Use =, >, <, >=, <= ou !=.")
+        return Comparison(column, token.text, self.literal(absorb_words=True))
+
+    def literal(self, absorb_words=False):
+        negative = bool(self.accept_op('-'))
+        token = self.next()
+        if token.kind == 'string':
+            return Literal(token.text[1:-1], quoted=True, negative=negative)
+        if token.kind == 'number' or (token.kind == 'word' and not token.keyword(*KEYWORDS)):
+            end = self._hyphenated(token.end)
+            if token.kind == 'number' and end == token.end:
+                return Literal(token.text, negative=negative)
+            # Valores sem aspas podem ter espaços, como em: FILTER cidade = São Paulo
+            while absorb_words:
+                following = self.peek()
+                if following is not None and following.kind == 'op' and following.text == '-':
+                    # Hífen com espaços, como em: FILTER produto = Cabo - 2m
+                    after = self.tokens[self.position + 1] if self.position + 1 < len(self.tokens) else None
+                    if after is None or after.kind not in ('word', 'number') or after.keyword(*KEYWORDS):
+                        break
+                    self.position += 1
+                    following = after
+                if following is None or following.kind not in ('word', 'number') or following.keyword(*KEYWORDS):
+                    break
+                end = self._hyphenated(self.next().end)
+            return Literal(self.text[token.start:end], negative=negative)
+        raise ValueError(f"Valor inválido: '{token.text}'.")
+
+    def _hyphenated(self, end):
+        '''Junta ao valor os trechos ligados por hífen sem espaços, como 2024-01-01 ou A-1.
+
+        Devolve a nova posição final do valor no texto.'''
+        while self.position + 1 < len(self.tokens):
+            hyphen, following = self.tokens[self.position], self.tokens[self.position + 1]
+            if not (hyphen.kind == 'op' and hyphen.text == '-' and hyphen.start == end
+                    and following.kind in ('word', 'number') and following.start == hyphen.end):
+                break
+            self.position += 2
+            end = following.end
+        return end
+
+    # expressão := termo (('+'|'-') termo)* ; termo := fator (('*'|'/') fator)*
+    def expression(self):
+        node = self.term()
+        while True:
+            token = self.accept_op('+', '-')
+            if token is None:
+                return node
+            node = BinaryOp(token.text, node, self.term())
+
+    def term(self):
+        node = self.factor()
+        while True:
+            token = self.accept_op('*', '/')
+            if token is None:
+                return node
+            node = BinaryOp(token.text, node, self.factor())
+
+    def factor(self):
+        if self.accept_op('-'):
+            return BinaryOp('-', Constant(0), self.factor())
+        if self.accept_op('('):
+            node = self.expression()
+            if not self.accept_op(')'):
+                raise ValueError("Parêntese não fechado na expressão.")
+            return node
+        token = self.next()
+        if token.kind == 'string':
+            return Constant(token.text[1:-1])
+        if token.kind == 'number':
+            return Constant(parse_literal(token.text))
+        if token.kind == 'word':
+            return ColumnRef(token.text)
+        raise ValueError(f"Expressão inválida perto de '{token.text}'.")
+
+
+def parse_condition(text):
+    'Compila uma condição (AND, OR, NOT, IN, BETWEEN, IS NULL) em uma árvore que gera máscaras.'
+    parser = _Parser(text)
+    if parser.peek() is None:
+        raise ValueError("Condição vazia.")
+    node = parser.condition()
+    parser.done()
+    return node
+
+
+def parse_expression(text):
+    'Compila a expressão de valor do UPDATE (constantes, colunas e + - * /).'
+    parser = _Parser(text)
+    if parser.peek() is None:
+        raise ValueError("Expressão vazia.")
+    node = parser.expression()
+    parser.done()
+    return _fold(node)
+
+
+def parse_update(text):
+    'Interpreta "coluna = expressão [WHERE condição]"; devolve (coluna, expressão, condição ou None).'
+    tokens = tokenize(text)
+    where = next((token for token in tokens if token.keyword('WHERE')), None)
+    assignment = text[:where.start] if where else text
+    column, sep, expression = assignment.partition('=')
+    if not sep or not strip_name(column):
+        raise ValueError("Sintaxe incorreta. Use: UPDATE coluna = valor WHERE condição")
+    condition = parse_condition(text[where.end:]) if where else None
+    return strip_name(column), parse_expression(expression), condition
+
+
+class Memo:
+    '''Guarda máscaras e valores já calculados, com limite de entradas (LRU).
+
+    A chave deve incluir a versão das colunas lidas, para que um UPDATE numa
+    delas faça o valor antigo deixar de ser encontrado.'''
+
+    def __init__(self, size=32):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key, compute):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        value = compute()
+        self.entries[key] = value
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.entries.clear()
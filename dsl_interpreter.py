@@ -3,8 +3,27 @@ import pandas as pd
 import json
 import csv
 import os
+import re
+import sys
 from tabulate import tabulate
 
+from dsl_agg import default_processes, parse_group_by
+from dsl_cache import TableCache, format_size, parse_size
+from dsl_expr import Memo, first_value, parse_condition, parse_update, strip_name
+from dsl_join import join_frames, load_indexed
+from dsl_profile import Profiler
+from dsl_plan import Dedupe, Filter, GroupBy, Join, Plan, Scan, Select, Sort, Update, check_columns, execute, optimize
+from dsl_stream import DEFAULT_CHUNK_ROWS, collect, run_stream, write_csv, write_json, write_stream
+from dsl_types import json_ready, memory_report
+from dsl_view import MaterializedView
+
+
+_ARGUMENTS = re.compile(r'''"[^"]*"|'[^']*'|\S+''')
+
+_JOIN_SYNTAX = re.compile(
+    r'''^\s*("[^"]*"|'[^']*'|\S+)\s+ON\s+("[^"]*"|'[^']*'|\S+)(?:\s+(INNER|LEFT|RIGHT|OUTER))?\s*$''',
+    re.IGNORECASE)
+
 
 class DSLInterpreter(cmd.Cmd):
     intro = "Bem-vindo à interface de linha de comando da DSL. Digite 'help' ou '?' para listar os comandos.\n"
@@ -12,176 +31,518 @@ class DSLInterpreter(cmd.Cmd):
     file = None
     command_count = 1
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, cache=None, stdout=None):
+        super().__init__(stdout=stdout)
+        self.cache = cache if cache is not None else TableCache()
+        self.masks = Memo()
+        self.data_version = 0
+        self.column_versions = {}
         self.data = None
         self.project = {}
         self.last_filter_value = None
+        self.mode = 'EAGER'
+        self.plan = None
+        # Arquivo do último LOAD e operações aplicadas desde então, em qualquer modo (usado pelo MATERIALIZE)
+        self.lineage = None
+        self.chunk_rows = DEFAULT_CHUNK_ROWS
+        self.processes = default_processes()
+        self.profiler = Profiler()
+        self.errors = []
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        # Um DataFrame novo invalida tudo o que foi memoizado sobre o anterior
+        self._data = value
+        self.data_version += 1
+        self.column_versions = {}
+        self.masks.clear()
+
+    def _memo_key(self, kind, node):
+        versions = tuple(self.column_versions.get(column, 0) for column in sorted(node.columns))
+        return kind, str(node), self.data_version, versions
 
     def precmd(self, line):
         self.prompt = f"{self.command_count} > "
         self.command_count += 1
         return line
 
+    def onecmd(self, line):
+        name = line.split()[0].upper() if line.strip() else ''
+        errors_before = len(self.errors)
+        lineage = len(self.lineage.steps) if self.lineage is not None else None
+        if not self.profiler.enabled or name in ('', 'PROFILE'):
+            stop = super().onecmd(line)
+        else:
+            with self.profiler.measure(line.strip(), self._row_count) as record:
+                stop = super().onecmd(line)
+                record['ok'] = len(self.errors) == errors_before
+        if len(self.errors) > errors_before and lineage is not None and self.lineage is not None:
+            # A operação que falhou não alterou os dados, então também sai da linhagem
+            del self.lineage.steps[lineage:]
+        return stop
+
+    def _row_count(self):
+        return len(self.data) if self.data is not None else None
+
+    def default(self, line):
+        self._error(f"Comando desconhecido: {line}")
+
+    def _print(self, message):
+        print(message, file=self.stdout)
+
+    def _error(self, message):
+        'Exibe a mensagem de erro e a registra para o modo em lote.'
+        self.errors.append(message)
+        self._print(message)
+
+    # Execução sem o prompt interativo
+    def run_line(self, line):
+        'Executa uma linha de script; devolve (sair, ok).'
+        errors_before = len(self.errors)
+        line = self.precmd(line)
+        stop = self.postcmd(self.onecmd(line), line)
+        return bool(stop), len(self.errors) == errors_before
+
+    def run_script(self, lines):
+        'Executa um script .dsl, ignorando linhas vazias e comentários (#). Devolve True se não houve erros.'
+        ok = True
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            stop, line_ok = self.run_line(line)
+            ok = ok and line_ok
+            if stop:
+                break
+        return ok
+
+    # Modo de execução
+    def do_MODE(self, arg):
+        'MODE [EAGER|LAZY|STREAM [linhas]]: Define se os comandos executam na hora, montam um plano ou processam o arquivo em blocos.'
+        parts = arg.split()
+        mode = parts[0].upper() if parts else ''
+        if not mode:
+            self._print(f"Modo atual: {self.mode}")
+        elif mode in ('EAGER', 'LAZY', 'STREAM'):
+            try:
+                chunk_rows = int(parts[1]) if mode == 'STREAM' and len(parts) > 1 else DEFAULT_CHUNK_ROWS
+                if chunk_rows <= 0:
+                    raise ValueError("o tamanho do bloco deve ser positivo")
+            except ValueError as e:
+                self._error(f"Erro ao alterar o modo: {e}")
+                return
+            if mode == 'EAGER' and not self._materialize():
+                return
+            self.mode = mode
+            self.chunk_rows = chunk_rows
+            if mode == 'STREAM':
+                self._print(f"Modo de execução alterado para STREAM (blocos de {chunk_rows} linhas).")
+            else:
+                self._print(f"Modo de execução alterado para {mode}.")
+        else:
+            self._error("Modo inválido. Use EAGER, LAZY ou STREAM.")
+
+    def do_PARALLEL(self, arg):
+        'PARALLEL [processos]: Define quantos processos o GROUP_BY pode usar em tabelas grandes (1 desliga).'
+        if not arg.strip():
+            self._print(f"GROUP_BY usa até {self.processes} processo(s).")
+            return
+        try:
+            processes = int(arg.strip())
+            if processes <= 0:
+                raise ValueError("o número de processos deve ser positivo")
+        except ValueError as e:
+            self._error(f"Erro ao alterar o paralelismo: {e}")
+            return
+        self.processes = processes
+        self._print(f"GROUP_BY passa a usar até {processes} processo(s).")
+
+    def do_PROFILE(self, arg):
+        'PROFILE [ON|OFF|SHOW|CLEAR|DUMP arquivo]: Mede tempo, linhas, pico de memória e bytes lidos/gravados de cada comando.'
+        parts = arg.split(maxsplit=1)
+        action = parts[0].upper() if parts else 'SHOW'
+        if action == 'ON':
+            self.profiler.start()
+            self._print("Perfil ativado: cada comando será medido.")
+        elif action == 'OFF':
+            self._show_profile()
+            self.profiler.stop()
+            self._print("Perfil desativado.")
+        elif action == 'SHOW':
+            self._show_profile()
+        elif action == 'CLEAR':
+            self.profiler.clear()
+            self._print("Medições apagadas.")
+        elif action == 'DUMP':
+            path = strip_name(parts[1]) if len(parts) > 1 else 'perfil.json'
+            try:
+                self.profiler.dump(path)
+                self._print(f"Rastro gravado em '{path}'.")
+            except OSError as e:
+                self._error(f"Erro ao gravar o rastro: {e}")
+        else:
+            self._error("Sintaxe incorreta. Use: PROFILE [ON|OFF|SHOW|CLEAR|DUMP arquivo]")
+
+    def _show_profile(self):
+        if not self.profiler.records:
+            self._print("Nenhum comando medido. Use PROFILE ON.")
+            return
+
+        def size(value):
+            return format_size(value) if value is not None else '-'
+
+        def count(value):
+            return value if value is not None else '-'
+
+        rows = []
+        for number, record in enumerate(self.profiler.records, 1):
+            command = record['command'] if len(record['command']) <= 40 else record['command'][:37] + '...'
+            rows.append([number, command + ('' if record['ok'] else ' (erro)'), f"{record['seconds']:.3f}",
+                         count(record['rows_in']), count(record['rows_out']), size(record['peak_memory']),
+                         size(record['bytes_read']), size(record['bytes_written'])])
+        totals = self.profiler.totals()
+        rows.append(['', 'Total', f"{totals['seconds']:.3f}", '', '', size(totals['peak_memory']),
+                     size(totals['bytes_read']), size(totals['bytes_written'])])
+        headers = ['#', 'Comando', 'Segundos', 'Linhas antes', 'Linhas depois', 'Pico de memória', 'Lido', 'Gravado']
+        self._print(tabulate(rows, headers=headers, tablefmt='pretty'))
+
+    def do_EXPLAIN(self, arg):
+        'EXPLAIN: Mostra o plano pendente já otimizado (modos LAZY e STREAM).'
+        if self.plan is None:
+            self._print("Nenhum plano pendente.")
+            return
+        plan = optimize(self.plan)
+        if self.mode == 'STREAM':
+            for step in plan.steps:
+                if isinstance(step, Join):
+                    step.strategy = step.stream_strategy(self.cache.memory_budget)
+        for line in plan.describe():
+            self._print(line)
+
+    def _explain_joins(self, plan):
+        'Informa a estratégia escolhida para cada JOIN executado pelo plano.'
+        for step in plan.steps:
+            if isinstance(step, Join) and step.strategy:
+                self._print(f"EXPLAIN: {step.describe()}")
+
+    def _materialize(self):
+        'Executa o plano pendente e guarda o resultado em self.data.'
+        if self.plan is not None:
+            plan, self.plan = self.plan, None
+            try:
+                if self.mode == 'STREAM':
+                    self.data = collect(run_stream(plan, self.chunk_rows, self.cache.memory_budget))
+                else:
+                    self.data = execute(plan, read_csv=self.cache.read_csv)
+            except Exception as e:
+                # O plano continua pendente: o erro não deve descartar o arquivo carregado
+                self.plan = plan
+                self._error(f"Erro ao executar o plano: {e}")
+                return False
+            self._explain_joins(plan)
+        return True
+
+    def _defer(self, step):
+        'Nos modos LAZY e STREAM, acrescenta a operação ao plano em vez de executá-la.'
+        if self.lineage is not None:
+            self.lineage.add(step)
+        if self.mode == 'EAGER':
+            return False
+        plan = self.plan if self.plan is not None else Plan(Scan(self.data))
+        # Uma coluna inexistente falha aqui, como no modo EAGER, e o passo não entra no plano
+        check_columns(Plan(plan.scan, plan.steps + [step]))
+        if self.plan is None:
+            self.plan = plan
+            self.data = None
+        self.plan.add(step)
+        return True
+
+    def _has_data(self):
+        return self.data is not None or self.plan is not None
+
+    def _streaming(self):
+        'Indica se os comandos de saída devem consumir o plano em blocos.'
+        return self.mode == 'STREAM' and self.plan is not None
+
+    def _run_stream(self):
+        return run_stream(self.plan, self.chunk_rows, self.cache.memory_budget)
+
+    # Cache de tabelas lidas
+    def do_CACHE(self, arg):
+        'CACHE [STATS|CLEAR|ON|OFF|BUDGET memória [disco]|DIR caminho]: Consulta e configura o cache de arquivos já lidos.'
+        parts = arg.split()
+        action = parts[0].upper() if parts else 'STATS'
+        try:
+            if action == 'STATS':
+                stats = self.cache.stats()
+                rows = [
+                    ['Ativo', 'sim' if stats['ativo'] else 'não'],
+                    ['Acertos (memória)', stats['acertos_memoria']],
+                    ['Acertos (disco)', stats['acertos_disco']],
+                    ['Faltas', stats['faltas']],
+                    ['Taxa de acerto', f"{stats['taxa_de_acerto']:.1%}"],
+                    ['Entradas em memória', stats['entradas_memoria']],
+                    ['Memória residente', f"{format_size(stats['memoria_residente'])} de {format_size(stats['orcamento_memoria'])}"],
+                    ['Entradas em disco', stats['entradas_disco']],
+                    ['Disco usado', f"{format_size(stats['disco_usado'])} de {format_size(stats['orcamento_disco'])}"],
+                    ['Índices de JOIN', f"{stats['indices_join']} ({format_size(stats['memoria_indices_join'])})"],
+                    ['Diretório', stats['diretorio']],
+                ]
+                self._print(tabulate(rows, tablefmt='pretty'))
+            elif action == 'CLEAR':
+                self.cache.clear()
+                self._print("Cache esvaziado com sucesso.")
+            elif action in ('ON', 'OFF'):
+                self.cache.enabled = action == 'ON'
+                self._print(f"Cache {'ativado' if self.cache.enabled else 'desativado'}.")
+            elif action == 'BUDGET' and len(parts) > 1:
+                self.cache.resize(parse_size(parts[1]), parse_size(parts[2]) if len(parts) > 2 else None)
+                self._print(f"Orçamento do cache: {format_size(self.cache.memory_budget)} em memória, "
+                      f"{format_size(self.cache.disk_budget)} em disco.")
+            elif action == 'DIR' and len(parts) > 1:
+                self.cache.directory = arg.split(None, 1)[1].strip().strip('"')
+                self._print(f"Diretório do cache alterado para '{self.cache.directory}'.")
+            else:
+                self._error("Sintaxe incorreta. Use: CACHE [STATS|CLEAR|ON|OFF|BUDGET memória [disco]|DIR caminho]")
+        except ValueError as e:
+            self._error(f"Erro ao configurar o cache: {e}")
+
     # Manipulação do CSV
     def do_LOAD(self, arg):
-        'LOAD [caminho]: Carrega um arquivo CSV para manipulação.'
+        'LOAD [caminho] [COMPACT]: Carrega um arquivo CSV para manipulação; COMPACT usa categorias, datas e números menores.'
         try:
-            path = arg.strip('"')
-            self.data = pd.read_csv(path)
-            print(f"Arquivo '{path}' carregado com sucesso.")
+            compact = re.search(r'\s+COMPACT\s*$', arg, re.IGNORECASE)
+            if compact:
+                arg = arg[:compact.start()]
+            path = arg.strip().strip('"')
+            if self.mode != 'EAGER':
+                if not os.path.exists(path):
+                    raise FileNotFoundError(f"Arquivo '{path}' não encontrado.")
+                self.plan = Plan(Scan(path, compact=bool(compact)))
+                self.lineage = Plan(Scan(path, compact=bool(compact)))
+                self.data = None
+                self._print(f"Arquivo '{path}' registrado no plano (modo {self.mode}).")
+                return
+            self.plan = None
+            self.data = self.cache.read_csv(path, compact=bool(compact))
+            self.lineage = Plan(Scan(path, compact=bool(compact)))
+            self._print(f"Arquivo '{path}' carregado com sucesso.")
         except Exception as e:
-            print(f"Erro ao carregar o arquivo: {e}")
+            self._error(f"Erro ao carregar o arquivo: {e}")
 
     def do_FILTER(self, arg):
-        'FILTER [coluna] [operador] [valor]: Filtra linhas com base em uma condição.'
-        if self.data is not None:
+        'FILTER [condição]: Filtra linhas com base em uma condição (=, !=, >, <, >=, <=, IN, BETWEEN, IS NULL, AND, OR, NOT).'
+        if self._has_data():
             try:
-                for operator in ['>=', '<=', '!=', '=', '>', '<']:
-                    if operator in arg:
-                        column, value = arg.split(operator, 1)
-                        column = column.strip().strip('"').strip("'")
-                        value = value.strip().strip('"').strip("'")
-                       
-                        if operator == '=':
-                            operator = '=='
-
-                        if value.isdigit() or value.replace('.', '', 1).isdigit():
-                            query_str = f"{column} {operator} {value}"
-                        else:
-                            query_str = f"{column} {operator} '{value}'"
-                        break
-                else:
-                    raise ValueError("Operador inválido. Use =, >, <, >=, <= ou !=.")
-               
-                self.data = self.data.query(query_str)
-                self.last_filter_value = value
-                print("Dados filtrados com sucesso.")
+                condition = parse_condition(arg)
+                value = first_value(condition)
+                self.last_filter_value = str(value) if value is not None else None
+                if self._defer(Filter(condition)):
+                    self._print("Filtro adicionado ao plano.")
+                    return
+                mask = self.masks.get(self._memo_key('mask', condition), lambda: condition.mask(self.data))
+                self.data = self.data[mask]
+                self._print("Dados filtrados com sucesso.")
             except Exception as e:
-                print(f"Erro ao filtrar os dados: {e}")
+                self._error(f"Erro ao filtrar os dados: {e}")
         else:
-            print("Nenhum dado carregado. Use o comando LOAD primeiro.")
+            self._error("Nenhum dado carregado. Use o comando LOAD primeiro.")
 
     def do_SELECT(self, arg):
         'SELECT [colunas]: Seleciona colunas específicas.'
-        if self.data is not None:
+        if self._has_data():
             try:
-                columns = [col.strip().strip('"').strip("'") for col in arg.split(',')]
+                columns = [strip_name(col) for col in arg.split(',')]
+                if self._defer(Select(columns)):
+                    self._print("Seleção de colunas adicionada ao plano.")
+                    return
                 self.data = self.data[columns]
-                print("Colunas selecionadas com sucesso.")
+                self._print("Colunas selecionadas com sucesso.")
             except KeyError as e:
-                print(f"Erro ao selecionar colunas: {e}")
+                self._error(f"Erro ao selecionar colunas: {e}")
             except Exception as e:
-                print(f"Erro inesperado: {e}")
+                self._error(f"Erro inesperado: {e}")
         else:
-            print("Nenhum dado carregado. Use o comando LOAD primeiro.")
+            self._error("Nenhum dado carregado. Use o comando LOAD primeiro.")
 
     def do_GROUP_BY(self, arg):
-        'GROUP_BY [coluna]: Agrupa os dados pela coluna especificada.'
-        if self.data is not None:
+        'GROUP_BY [coluna, ...] [AGG sum(col), count(*), avg(col), min(col), max(col), count_distinct(col)]: Agrupa os dados pelas colunas especificadas.'
+        if self._has_data():
             try:
-                column = arg.strip().strip('"')
-                self.data = self.data.groupby(column).sum().reset_index()
-                print(f"Dados agrupados pela coluna '{column}' com sucesso.")
+                keys, aggregations = parse_group_by(arg)
+                step = GroupBy(keys, aggregations, self.processes)
+                names = ', '.join(f"'{key}'" for key in keys)
+                target = f"pela coluna {names}" if len(keys) == 1 else f"pelas colunas {names}"
+                if self._defer(step):
+                    self._print(f"Agrupamento {target} adicionado ao plano.")
+                    return
+                self.data = step.apply(self.data)
+                self._print(f"Dados agrupados {target} com sucesso.")
             except Exception as e:
-                print(f"Erro ao agrupar os dados: {e}")
+                self._error(f"Erro ao agrupar os dados: {e}")
         else:
-            print("Nenhum dado carregado. Use o comando LOAD primeiro.")
+            self._error("Nenhum dado carregado. Use o comando LOAD primeiro.")
 
     def do_SORT_BY(self, arg):
         'SORT_BY [coluna] [ordem]: Ordena os dados de acordo com uma coluna específica.'
-        if self.data is not None:
+        if self._has_data():
             try:
                 parts = arg.split()
                 column = parts[0].strip().strip('"')
                 order = parts[1].strip().upper() if len(parts) > 1 else 'ASC'
                 ascending = True if order == 'ASC' else False
+                if self._defer(Sort(column, ascending)):
+                    self._print(f"Ordenação pela coluna '{column}' adicionada ao plano.")
+                    return
                 self.data = self.data.sort_values(by=column, ascending=ascending)
-                print(f"Dados ordenados pela coluna '{column}' em ordem {'ascendente' if ascending else 'descendente'}.")
+                self._print(f"Dados ordenados pela coluna '{column}' em ordem {'ascendente' if ascending else 'descendente'}.")
             except Exception as e:
-                print(f"Erro ao ordenar os dados: {e}")
+                self._error(f"Erro ao ordenar os dados: {e}")
         else:
-            print("Nenhum dado carregado. Use o comando LOAD primeiro.")
+            self._error("Nenhum dado carregado. Use o comando LOAD primeiro.")
 
     def do_UPDATE(self, arg):
-        'UPDATE [coluna] [novo_valor] WHERE [condição]: Atualiza valores em uma coluna com base em uma condição.'
-        if self.data is not None:
+        'UPDATE [coluna] = [expressão] WHERE [condição]: Atualiza valores em uma coluna com base em uma condição.'
+        if self._has_data():
             try:
                 # Divida a entrada em duas partes: a parte de atualização e a condição
-                update_part, condition = arg.split("WHERE")
-                column, new_value_expression = update_part.strip().split("=")
-                column = column.strip().strip('"').strip("'")
-                condition = condition.strip().replace("==", "=").replace("'", "").replace('"', '')
-                condition_column, condition_value = condition.split("=")
-                condition_column = condition_column.strip()
-                condition_value = condition_value.strip()
+                column, expression, condition = parse_update(arg)
+                step = Update(column, expression, condition)
+                if self._defer(step):
+                    self._print(f"Atualização da coluna '{column}' adicionada ao plano.")
+                    return
 
                 # Verificar se a coluna existe no DataFrame
                 if column in self.data.columns:
-                    mask = self.data[condition_column] == condition_value
-                    self.data.loc[mask, column] = pd.eval(new_value_expression)  # Avaliando a expressão do novo valor
-                    print(f"Valores atualizados na coluna '{column}' onde '{condition_column} == {condition_value}'.")
+                    # Máscara e valor memoizados pela versão das colunas que leem
+                    mask = (self.masks.get(self._memo_key('mask', condition), lambda: step.mask(self.data))
+                            if condition is not None else None)
+                    value = self.masks.get(self._memo_key('valor', expression),
+                                           lambda: expression.evaluate(self.data))
+                    step.apply(self.data, mask, value)
+                    self.column_versions[column] = self.column_versions.get(column, 0) + 1
+                    where = f" onde {condition}" if condition is not None else ''
+                    self._print(f"Valores atualizados na coluna '{column}'{where}.")
                 else:
-                    print(f"Coluna '{column}' não encontrada.")
+                    self._error(f"Coluna '{column}' não encontrada.")
             except Exception as e:
-                print(f"Erro ao atualizar os dados: {e}")
+                self._error(f"Erro ao atualizar os dados: {e}")
         else:
-            print("Nenhum dado carregado. Use o comando LOAD primeiro.")
+            self._error("Nenhum dado carregado. Use o comando LOAD primeiro.")
 
     def do_SHOW(self, arg):
         'SHOW: Exibe os dados atuais.'
+        if not self._materialize():
+            return
         if self.data is not None:
-            print(tabulate(self.data, headers='keys', tablefmt='pretty'))  # Exibindo os dados de forma tabular
+            self._print(tabulate(self.data, headers='keys', tablefmt='pretty'))  # Exibindo os dados de forma tabular
         else:
-            print("Nenhum dado para exibir.")
+            self._error("Nenhum dado para exibir.")
+
+    def do_MEMORY(self, arg):
+        'MEMORY: Mostra os bytes de cada coluna com os tipos padrão do pandas e com os tipos atuais.'
+        if not self._materialize():
+            return
+        if self.data is None:
+            self._error("Nenhum dado carregado. Use o comando LOAD primeiro.")
+            return
+        rows = []
+        total_before = total_after = 0
+        for name, default, current, before, after in memory_report(self.data):
+            tipo = current if default == current else f"{default} -> {current}"
+            rows.append([name, tipo, format_size(before), format_size(after),
+                         f"{1 - after / before:.0%}" if before else '-'])
+            total_before += before
+            total_after += after
+        rows.append(['Total', '', format_size(total_before), format_size(total_after),
+                     f"{1 - total_after / total_before:.0%}" if total_before else '-'])
+        self._print(tabulate(rows, headers=['Coluna', 'Tipo', 'Antes', 'Depois', 'Economia'], tablefmt='pretty'))
 
     def do_SAVE(self, arg):
         'SAVE [caminho]: Salva os dados atuais em um arquivo CSV.'
+        if self._streaming():
+            try:
+                path = arg.strip('"')
+                write_stream(write_csv, self._run_stream, path)
+                self._print(f"Dados salvos em '{path}' com sucesso.")
+                self._explain_joins(self.plan)
+            except Exception as e:
+                self._error(f"Erro ao salvar os dados: {e}")
+            return
+        if not self._materialize():
+            return
         if self.data is not None:
             try:
                 path = arg.strip('"')
                 self.data.to_csv(path, index=False)
-                print(f"Dados salvos em '{path}' com sucesso.")
+                self._print(f"Dados salvos em '{path}' com sucesso.")
             except Exception as e:
-                print(f"Erro ao salvar os dados: {e}")
+                self._error(f"Erro ao salvar os dados: {e}")
         else:
-            print("Nenhum dado para salvar.")
+            self._error("Nenhum dado para salvar.")
 
     def do_JOIN(self, arg):
-        'JOIN [outro_arquivo] ON [coluna]: Realiza um join com outro arquivo CSV baseado em uma coluna comum.'
+        'JOIN [outro_arquivo] ON [coluna] [INNER|LEFT|RIGHT|OUTER]: Realiza um join com outro arquivo CSV baseado em uma coluna comum.'
         try:
-            parts = arg.split('ON')
-            if len(parts) != 2:
-                print("Sintaxe incorreta. Use: JOIN [outro_arquivo] ON [coluna]")
+            match = _JOIN_SYNTAX.match(arg)
+            if match is None:
+                self._error("Sintaxe incorreta. Use: JOIN [outro_arquivo] ON [coluna] [INNER|LEFT|RIGHT|OUTER]")
                 return
 
-            other_file = parts[0].strip().strip('"')
-            join_column = parts[1].strip().strip('"')
+            other_file = strip_name(match.group(1))
+            join_column = strip_name(match.group(2))
+            how = (match.group(3) or 'INNER').lower()
+            if not os.path.exists(other_file):
+                raise FileNotFoundError(f"Arquivo '{other_file}' não encontrado.")
 
-            other_data = pd.read_csv(other_file)
-            print(f"Colunas no arquivo '{other_file}': {other_data.columns.tolist()}")
-            print(f"Colunas no arquivo principal: {self.data.columns.tolist()}")
+            if not self._has_data():
+                self._error("Nenhum dado carregado. Use o comando LOAD primeiro.")
+                return
+            read_csv = pd.read_csv if self.mode == 'STREAM' else self.cache.read_csv
+            if self._defer(Join(other_file, join_column, how, read_csv)):
+                self._print(f"Join com '{other_file}' na coluna '{join_column}' ({how.upper()}) adicionado ao plano.")
+                return
 
-            self.data = pd.merge(self.data, other_data, on=join_column, how='inner')
-            print(f"Join com '{other_file}' realizado com sucesso na coluna '{join_column}'.")
+            # Arquivo e índice da chave ficam guardados para os próximos JOINs
+            other_data, index = load_indexed(other_file, join_column, read_csv)
+            self._print(f"Colunas no arquivo '{other_file}': {other_data.columns.tolist()}")
+            self._print(f"Colunas no arquivo principal: {self.data.columns.tolist()}")
+
+            self.data, strategy = join_frames(self.data, other_data, join_column, how, index)
+            self._print(f"Join com '{other_file}' realizado com sucesso na coluna '{join_column}'.")
+            self._print(f"EXPLAIN: JOIN '{other_file}' ON {join_column} ({how.upper()}) estratégia={strategy}")
         except Exception as e:
-            print(f"Erro ao realizar o join: {e}")
+            self._error(f"Erro ao realizar o join: {e}")
 
     def do_REMOVE_DUPLICATES(self, arg):
         'REMOVE_DUPLICATES [coluna]: Remove linhas duplicadas com base em uma coluna.'
-        if self.data is not None:
+        if self._has_data():
             try:
                 column = arg.strip('"')
+                if self._defer(Dedupe(column)):
+                    self._print(f"Remoção de duplicatas pela coluna '{column}' adicionada ao plano.")
+                    return
                 self.data = self.data.drop_duplicates(subset=column)
-                print(f"Linhas duplicadas removidas com base na coluna '{column}'.")
+                self._print(f"Linhas duplicadas removidas com base na coluna '{column}'.")
             except Exception as e:
-                print(f"Erro ao remover duplicatas: {e}")
+                self._error(f"Erro ao remover duplicatas: {e}")
         else:
-            print("Nenhum dado carregado. Use o comando LOAD primeiro.")
+            self._error("Nenhum dado carregado. Use o comando LOAD primeiro.")
 
     def do_EXPORT_JSON(self, arg):
-        'EXPORT_JSON [caminho]: Exporta os dados para um arquivo JSON.'
-        if self.data is not None:
+        'EXPORT_JSON [caminho] [NDJSON]: Exporta os dados para um arquivo JSON (array de registros ou um registro por linha).'
+        parts = arg.split()
+        lines = bool(parts) and parts[-1].upper() == 'NDJSON'
+        if lines:
+            arg = arg.rstrip()[:-len('NDJSON')]
+        arg = arg.strip()
+        if not self._streaming() and not self._materialize():
+            return
+        if self._has_data():
             try:
                 if not arg.strip():
                     if self.last_filter_value:
@@ -191,16 +552,62 @@ class DSLInterpreter(cmd.Cmd):
                 else:
                     filename = arg.strip('"')
                 
-                self.data.to_json(filename, orient='records')
-                print(f"Dados exportados para '{filename}' com sucesso.")
+                if self._streaming():
+                    write_stream(write_json, self._run_stream, filename, lines=lines)
+                    self._explain_joins(self.plan)
+                else:
+                    json_ready(self.data).to_json(filename, orient='records', lines=lines)
+                self._print(f"Dados exportados para '{filename}' com sucesso.")
             except Exception as e:
-                print(f"Erro ao exportar os dados: {e}")
+                self._error(f"Erro ao exportar os dados: {e}")
         else:
-            print("Nenhum dado para exportar.")
+            self._error("Nenhum dado para exportar.")
+
+    def do_MATERIALIZE(self, arg):
+        'MATERIALIZE [nome] [saida.csv]: Grava o resultado das operações desde o LOAD como uma view que o REFRESH atualiza só com as linhas novas.'
+        names = [strip_name(token) for token in _ARGUMENTS.findall(arg)]
+        if not names or len(names) > 2:
+            self._error("Sintaxe incorreta. Use: MATERIALIZE [nome] [saida.csv]")
+            return
+        if self.lineage is None:
+            self._error("Nenhum arquivo carregado. Use o comando LOAD primeiro.")
+            return
+        name = names[0]
+        output = names[1] if len(names) > 1 else f"{name}.csv"
+        try:
+            view = MaterializedView(name, self.lineage, output, chunksize=self.chunk_rows)
+            result = view.build()
+            view.save()
+            self._print(f"View '{name}' materializada em '{output}': {result['linhas_lidas']} linhas lidas, "
+                        f"{result['linhas_resultado']} linhas no resultado.")
+            if not view.incremental:
+                self._print("Aviso: com JOIN RIGHT ou OUTER antes do agrupamento, o REFRESH sempre reconstrói a view.")
+        except Exception as e:
+            self._error(f"Erro ao materializar a view: {e}")
+
+    def do_REFRESH(self, arg):
+        'REFRESH [nome]: Atualiza a view com as linhas acrescentadas ao arquivo desde a última vez.'
+        name = strip_name(arg)
+        if not name:
+            self._error("Sintaxe incorreta. Use: REFRESH [nome]")
+            return
+        try:
+            view = MaterializedView.load(name)
+            result = view.refresh()
+            view.save()
+            if result['tipo'] == 'sem novidades':
+                self._print(f"View '{name}' já está atualizada: nenhuma linha nova em '{view.source}'.")
+            else:
+                self._print(f"View '{name}' atualizada ({result['tipo']}): {result['linhas_lidas']} linhas lidas, "
+                            f"{result['linhas_resultado']} linhas no resultado em '{view.output}'.")
+        except KeyError as e:
+            self._error(str(e.args[0]))
+        except Exception as e:
+            self._error(f"Erro ao atualizar a view: {e}")
 
     def do_EXIT(self, arg):
         'EXIT: Sai da interface de linha de comando.'
-        print("Saindo da interface DSL.")
+        self._print("Saindo da interface DSL.")
         return True
 
     def do_EOF(self, arg):
@@ -208,4 +615,11 @@ class DSLInterpreter(cmd.Cmd):
 
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        # Modo em lote: python dsl_interpreter.py script1.dsl [script2.dsl ...]
+        ok = True
+        for script in sys.argv[1:]:
+            with open(script, encoding='utf-8') as f:
+                ok = DSLInterpreter().run_script(f) and ok
+        sys.exit(0 if ok else 1)
     DSLInterpreter().cmdloop()
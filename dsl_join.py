@@ -0,0 +1,289 @@
+import os
+import pickle
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from dsl_types import widen
+
+
+JOIN_TYPES = ('INNER', 'LEFT', 'RIGHT', 'OUTER')
+
+# Memória para tabelas e índices de JOIN guardados entre comandos; o TableCache
+# a ajusta junto com o próprio orçamento (CACHE BUDGET)
+DEFAULT_INDEX_BUDGET = 256 * 1024 ** 2
+
+# Número máximo de partições do join particionado
+MAX_PARTITIONS = 256
+
+
+class HashIndex:
+    '''Índice de hash sobre a coluna de junção de uma tabela.
+
+    As chaves são fatoradas em códigos; as linhas de cada código ficam contíguas
+    em "order", então uma busca devolve o início e a quantidade de linhas de
+    cada chave.'''
+
+    def __init__(self, keys):
+        codes, uniques = pd.factorize(keys, use_na_sentinel=False)
+        self.uniques = pd.Index(uniques)
+        self.order = np.argsort(codes, kind='stable')
+        self.counts = np.bincount(codes, minlength=len(uniques))
+        self.starts = np.cumsum(self.counts) - self.counts
+        self.dtype = keys.dtype
+        self.is_sorted = bool(keys.is_monotonic_increasing)
+        self.keys = keys.to_numpy() if self.is_sorted else None
+
+    @property
+    def nbytes(self):
+        arrays = (self.order, self.counts, self.starts) + ((self.keys,) if self.keys is not None else ())
+        return int(self.uniques.memory_usage(deep=True) + sum(array.nbytes for array in arrays))
+
+    def probe(self, keys):
+        'Para cada chave buscada, devolve (quantidade, início) das linhas correspondentes.'
+        if not len(self.uniques):
+            empty = np.zeros(len(keys), dtype=np.intp)
+            return empty, empty
+        codes = self.uniques.get_indexer(keys)
+        found = codes >= 0
+        return np.where(found, self.counts[codes], 0), np.where(found, self.starts[codes], 0)
+
+
+def _expand(counts, starts, order, keep_unmatched):
+    '''Transforma (quantidade, início) por linha em pares de posições (esquerda, direita).
+
+    Com keep_unmatched, linhas sem par aparecem uma vez com posição -1 do outro lado.'''
+    matched = counts > 0
+    if keep_unmatched:
+        counts = np.maximum(counts, 1)
+    outer_pos = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(len(outer_pos)) - np.repeat(np.cumsum(counts) - counts, counts)
+    inner_pos = np.repeat(np.where(matched, starts, 0), counts) + offsets
+    inner_pos = order[inner_pos] if len(order) else inner_pos
+    if keep_unmatched:
+        inner_pos = np.where(np.repeat(matched, counts), inner_pos, -1)
+    return outer_pos, inner_pos
+
+
+def _sort_merge(outer_keys, inner_keys, keep_unmatched):
+    'Posições do join quando as duas chaves já estão ordenadas: busca binária em vez de hash.'
+    lo = np.searchsorted(inner_keys, outer_keys, side='left')
+    hi = np.searchsorted(inner_keys, outer_keys, side='right')
+    return _expand(hi - lo, lo, np.arange(len(inner_keys)), keep_unmatched)
+
+
+def _take(df, positions):
+    'Linhas nas posições dadas; -1 vira uma linha de NaN.'
+    df = df.reset_index(drop=True)
+    if len(positions) and positions.min() < 0:
+        return df.reindex(positions).reset_index(drop=True)
+    return df.take(positions).reset_index(drop=True)
+
+
+def _assemble(left, right, key, left_pos, right_pos, how):
+    'Monta o resultado com as mesmas colunas e sufixos que o pd.merge geraria.'
+    left_part = _take(left, left_pos)
+    right_part = _take(right, right_pos).drop(columns=[key])
+    overlap = set(left_part.columns) & set(right_part.columns)
+    left_part = left_part.rename(columns={c: f"{c}_x" for c in overlap})
+    right_part = right_part.rename(columns={c: f"{c}_y" for c in overlap})
+    if how in ('right', 'outer'):
+        right_keys = _take(right[[key]], right_pos)[key]
+        left_part[key] = right_keys if how == 'right' else left_part[key].fillna(right_keys)
+    return pd.concat([left_part, right_part], axis=1)
+
+
+def join_frames(left, right, key, how='inner', index=None):
+    '''Junta dois DataFrames como pd.merge(left, right, on=key, how=how).
+
+    Devolve (resultado, estratégia). Com as duas chaves ordenadas usa sort-merge;
+    senão usa o índice de hash da direita (reaproveitado se vier em "index").
+    OUTER, tipos de chave diferentes e chaves com NaN ficam com o pd.merge.'''
+    if key not in left.columns or key not in right.columns:
+        raise KeyError(key)
+    # Chaves compactas (int8, categoria) são comparadas no tipo largo, como as do outro lado
+    left_keys, right_keys = widen(left[key]), widen(right[key])
+    if (how == 'outer' or left_keys.dtype != right_keys.dtype
+            or left_keys.isna().any() or right_keys.isna().any()):
+        # Nesses casos a ordem das linhas do pd.merge segue regras próprias
+        return pd.merge(left, right, on=key, how=how), 'pandas_merge'
+
+    if how == 'right':
+        # Mesma técnica com os papéis trocados: para cada linha da direita, os pares da esquerda
+        outer_keys, inner = right_keys, HashIndex(left_keys)
+    else:
+        outer_keys, inner = left_keys, index if index is not None else HashIndex(right_keys)
+    keep = how != 'inner'
+
+    if inner.is_sorted and outer_keys.is_monotonic_increasing:
+        outer_pos, inner_pos = _sort_merge(outer_keys.to_numpy(), inner.keys, keep)
+        strategy = 'sort_merge'
+    else:
+        counts, starts = inner.probe(outer_keys)
+        outer_pos, inner_pos = _expand(counts, starts, inner.order, keep)
+        strategy = 'hash_index'
+
+    if how == 'right':
+        return _assemble(left, right, key, inner_pos, outer_pos, how), strategy
+    return _assemble(left, right, key, outer_pos, inner_pos, how), strategy
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+class IndexCache:
+    '''Tabelas da direita dos JOINs e os índices das suas chaves, entre um comando e outro.
+
+    Limitado em bytes, descartando as entradas menos usadas. Quando o leitor
+    já guarda as tabelas (o read_csv de um TableCache ativo), só o índice fica
+    aqui e a tabela é pedida de novo ao leitor, para não ser guardada duas vezes.'''
+
+    def __init__(self, memory_budget=DEFAULT_INDEX_BUDGET):
+        self.memory_budget = memory_budget
+        self.entries = OrderedDict()
+        self.memory_bytes = 0
+
+    def get(self, path, key, read_csv):
+        keep_table = not getattr(getattr(read_csv, '__self__', None), 'keeps_tables', False)
+        cache_key = (_signature(path), key, keep_table)
+        if cache_key in self.entries:
+            self.entries.move_to_end(cache_key)
+            right, index, _ = self.entries[cache_key]
+            return (right if keep_table else read_csv(path)), index
+        right = read_csv(path)
+        if key not in right.columns:
+            raise KeyError(key)
+        index = HashIndex(right[key])
+        size = index.nbytes + (int(right.memory_usage(deep=True).sum()) if keep_table else 0)
+        if size <= self.memory_budget:
+            self.entries[cache_key] = (right if keep_table else None, index, size)
+            self.memory_bytes += size
+            self._evict()
+        return right, index
+
+    def _evict(self):
+        while self.memory_bytes > self.memory_budget:
+            _, (_, _, size) = self.entries.popitem(last=False)
+            self.memory_bytes -= size
+
+    def resize(self, memory_budget):
+        self.memory_budget = memory_budget
+        self._evict()
+
+    def clear(self):
+        self.entries.clear()
+        self.memory_bytes = 0
+
+
+indexes = IndexCache()
+
+
+def load_indexed(path, key, read_csv=pd.read_csv):
+    '''Lê o arquivo da direita e o índice da sua chave, mantidos entre comandos.
+
+    O índice é refeito se o arquivo mudar de tamanho ou data de modificação.'''
+    return indexes.get(path, key, read_csv)
+
+
+def estimate_bytes(path):
+    'Estimativa grosseira da memória para carregar o CSV (o dobro do tamanho em disco).'
+    return 2 * os.path.getsize(path)
+
+
+def partition_count(path, memory_budget):
+    return int(min(MAX_PARTITIONS, max(2, -(-estimate_bytes(path) // max(memory_budget // 2, 1)))))
+
+
+class _Spill:
+    'Arquivos temporários, um por partição, com blocos gravados em sequência via pickle.'
+
+    def __init__(self, directory, name, partitions):
+        self.paths = [os.path.join(directory, f"{name}-{p}.pkl") for p in range(partitions)]
+
+    @staticmethod
+    def _hash_keys(keys):
+        '''Chaves no tipo usado para escolher a partição.
+
+        O pd.merge considera iguais 1 (int8 ou int64) e 1.0, mas os hashes desses
+        valores diferem; números vão todos para float64 para que chaves iguais
+        caiam na mesma partição dos dois lados. Somar 0.0 troca -0.0 por 0.0.'''
+        keys = widen(keys)
+        if pd.api.types.is_numeric_dtype(keys.dtype) and not pd.api.types.is_bool_dtype(keys.dtype):
+            return keys.to_numpy(dtype='float64', na_value=np.nan) + 0.0
+        return keys.to_numpy()
+
+    def write(self, df, key):
+        if not len(df):
+            return
+        parts = pd.util.hash_array(self._hash_keys(df[key])) % len(self.paths)
+        for p in np.unique(parts):
+            with open(self.paths[p], 'ab') as f:
+                pickle.dump(df[parts == p], f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def read(self, p, empty):
+        chunks = []
+        if os.path.exists(self.paths[p]):
+            with open(self.paths[p], 'rb') as f:
+                while True:
+                    try:
+                        chunks.append(pickle.load(f))
+                    except EOFError:
+                        break
+        return pd.concat(chunks, ignore_index=True) if chunks else empty
+
+
+class PartitionedJoin:
+    '''Join particionado com transbordo para disco, para quando nenhum lado cabe na memória.
+
+    Os dois lados são espalhados em partições pelo hash da chave; cada par de
+    partições cabe na memória e é juntado separadamente. As linhas saem agrupadas
+    por partição, não na ordem da tabela da esquerda.'''
+
+    def __init__(self, path, key, how, partitions, chunksize):
+        self.path = path
+        self.key = key
+        self.how = how
+        self.chunksize = chunksize
+        self.partitions = partitions
+        self.directory = None
+        self.left_empty = None
+
+    def _open(self):
+        # A pasta temporária só é criada quando o primeiro bloco chega
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='dsl_join_')
+            self.left = _Spill(self.directory, 'esquerda', self.partitions)
+            self.right = _Spill(self.directory, 'direita', self.partitions)
+
+    def add(self, chunk):
+        self._open()
+        if self.left_empty is None:
+            self.left_empty = chunk.iloc[:0]
+        self.left.write(chunk, self.key)
+
+    def results(self):
+        self._open()
+        try:
+            right_empty = None
+            for chunk in pd.read_csv(self.path, chunksize=self.chunksize):
+                right_empty = chunk.iloc[:0] if right_empty is None else right_empty
+                self.right.write(chunk, self.key)
+            if right_empty is None:
+                right_empty = pd.read_csv(self.path, nrows=0)
+            rows = 0
+            for p in range(len(self.left.paths)):
+                left = self.left.read(p, self.left_empty)
+                right = self.right.read(p, right_empty)
+                if len(left) or len(right):
+                    result = join_frames(left, right, self.key, self.how)[0]
+                    # Numeração contínua entre as partições, como no resultado de um join só
+                    result.index = pd.RangeIndex(rows, rows + len(result))
+                    rows += len(result)
+                    yield result
+        finally:
+            shutil.rmtree(self.directory, ignore_errors=True)
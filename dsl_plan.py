@@ -0,0 +1,422 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from dsl_agg import ERR_SUFFIX, PARALLEL_MIN_ROWS, can_parallelize, compensated_sums, parallel_apply
+from dsl_expr import combine
+from dsl_join import estimate_bytes, join_frames, load_indexed
+from dsl_types import concat_chunks, read_csv, widen
+
+
+# Quantidade de linhas lidas por vez quando há filtros empurrados para a leitura
+SCAN_CHUNK_ROWS = 100_000
+
+# Linhas lidas para inferir os tipos ao conferir as colunas de um plano adiado
+CHECK_ROWS = 100
+
+
+@dataclass
+class Scan:
+    'Origem do plano: um arquivo CSV ou um DataFrame já carregado.'
+    source: object
+    usecols: list = None
+    condition: object = None
+    compact: bool = False
+
+    @property
+    def options(self):
+        'Opções extras de leitura do arquivo.'
+        return {'compact': True} if self.compact else {}
+
+    def describe(self):
+        origem = f"'{self.source}'" if isinstance(self.source, str) else 'dados em memória'
+        texto = f"SCAN {origem}"
+        if self.compact:
+            texto += " compacto"
+        if self.usecols is not None:
+            texto += f" usecols={self.usecols}"
+        if self.condition is not None:
+            texto += f" filtro=[{self.condition}]"
+        return texto
+
+
+@dataclass
+class Filter:
+    condition: object
+
+    @property
+    def columns(self):
+        return self.condition.columns
+
+    def apply(self, df):
+        return df[self.condition.mask(df)]
+
+    def describe(self):
+        return f"FILTER {self.condition}"
+
+
+@dataclass
+class Select:
+    names: list
+
+    @property
+    def columns(self):
+        return set(self.names)
+
+    def apply(self, df):
+        return df[self.names]
+
+    def describe(self):
+        return f"SELECT {self.names}"
+
+
+@dataclass
+class Sort:
+    column: str
+    ascending: bool = True
+
+    @property
+    def columns(self):
+        return {self.column}
+
+    def apply(self, df):
+        return df.sort_values(by=self.column, ascending=self.ascending)
+
+    def describe(self):
+        return f"SORT_BY {self.column} {'ASC' if self.ascending else 'DESC'}"
+
+
+@dataclass
+class Dedupe:
+    column: str
+
+    @property
+    def columns(self):
+        return {self.column}
+
+    def apply(self, df):
+        return df.drop_duplicates(subset=self.column)
+
+    def describe(self):
+        return f"REMOVE_DUPLICATES {self.column}"
+
+
+def _assignment_dtype(current, value):
+    'Tipo que a coluna precisa ter para receber o valor sem perda.'
+    incoming = value.dtype if isinstance(value, pd.Series) else pd.Series([value]).dtype
+    if incoming == current:
+        return current
+    if isinstance(current, np.dtype) and isinstance(incoming, np.dtype):
+        return np.result_type(current, incoming)
+    return np.dtype(object)
+
+
+@dataclass
+class Update:
+    column: str
+    expression: object
+    condition: object = None
+
+    @property
+    def columns(self):
+        columns = {self.column} | self.expression.columns
+        return columns | self.condition.columns if self.condition is not None else columns
+
+    def mask(self, df):
+        if self.condition is None:
+            return np.ones(len(df), dtype=bool)
+        return self.condition.mask(df)
+
+    def apply(self, df, mask=None, value=None):
+        'Altera df no lugar; mask e value podem vir já calculados (memoizados).'
+        if self.column not in df.columns:
+            raise KeyError(self.column)
+        # Categorias e inteiros pequenos não aceitariam qualquer valor novo
+        widened = widen(df[self.column])
+        if widened.dtype != df[self.column].dtype:
+            df[self.column] = widened
+        if mask is None:
+            mask = self.mask(df)
+        if value is None:
+            value = self.expression.evaluate(df)
+        if isinstance(value, pd.Series):
+            value = value[mask]
+        if mask.any():
+            # Como o pandas fazia antes: salario * 1.1 numa coluna int64 a transforma em float64
+            dtype = _assignment_dtype(df[self.column].dtype, value)
+            if dtype != df[self.column].dtype:
+                df[self.column] = df[self.column].astype(dtype)
+        df.loc[mask, self.column] = value
+        return df
+
+    def describe(self):
+        where = f" WHERE {self.condition}" if self.condition is not None else ''
+        return f"UPDATE {self.column} = {self.expression}{where}"
+
+
+@dataclass
+class GroupBy:
+    '''GROUP_BY por uma ou mais chaves.
+
+    Sem agregações soma todas as colunas; com elas, cada Aggregation gera uma
+    coluna. Com processes > 1, tabelas grandes são agregadas em paralelo.'''
+    keys: list
+    aggregations: list = None
+    processes: int = field(default=1, compare=False, repr=False)
+
+    @property
+    def columns(self):
+        if self.aggregations is None:
+            # A soma usa todas as colunas
+            return None
+        columns = list(self.keys)
+        for aggregation in self.aggregations:
+            if aggregation.column is not None and aggregation.column not in columns:
+                columns.append(aggregation.column)
+        return columns
+
+    def apply(self, df):
+        if self.processes > 1 and len(df) >= PARALLEL_MIN_ROWS and can_parallelize():
+            return parallel_apply(df, self, self.keys, self.processes)
+        # Mesmo caminho do modo STREAM, para que os dois modos deem o mesmo resultado
+        return self.finish(self.partial(df))
+
+    def partial(self, df):
+        'Agregação parcial de um bloco, indexada pela chave.'
+        # Tipos compactos voltam ao tipo largo: somas em int8 estourariam
+        df = df.assign(**{name: widen(df[name]) for name in df.columns if name not in self.keys})
+        grouped = df.groupby(self.keys, observed=True)
+        if self.aggregations is not None:
+            index = grouped.size().index
+            states = {}
+            for position, aggregation in enumerate(self.aggregations):
+                for state, values in aggregation.partial(df, grouped, index).items():
+                    states[f"{position}\0{state}"] = values
+            return pd.DataFrame(states, index=index)
+
+        # A soma de todas as colunas concatena textos; datas compactas voltam a ser texto
+        dates = [name for name in df.columns if name not in self.keys and df[name].dtype.kind == 'M']
+        if dates:
+            df = df.assign(**{name: widen(df[name], dates_as_text=True) for name in dates})
+            grouped = df.groupby(self.keys, observed=True)
+        result = grouped.sum()
+        for name in df.columns:
+            if name not in self.keys and df[name].dtype.kind == 'f':
+                result[name], result[name + ERR_SUFFIX] = compensated_sums(grouped, df[name])
+        return result
+
+    def combine(self, partials):
+        'Junta agregações parciais em uma só.'
+        stacked = pd.concat(partials)
+        grouped = stacked.groupby(level=list(range(stacked.index.nlevels)), observed=True)
+        if self.aggregations is not None:
+            combined = {}
+            for position, aggregation in enumerate(self.aggregations):
+                prefix = f"{position}\0"
+                states = {name[len(prefix):]: name for name in stacked.columns if name.startswith(prefix)}
+                for state, values in aggregation.combine(grouped, states).items():
+                    combined[prefix + state] = values
+            return pd.DataFrame(combined)
+
+        # Somas de floats são juntadas com o resto de cada bloco, para que o
+        # resultado seja o mesmo da soma de uma vez
+        result = grouped.sum()
+        for name in stacked.columns:
+            if not name.endswith(ERR_SUFFIX) and stacked[name].dtype.kind == 'f':
+                result[name], err = compensated_sums(grouped, stacked[name])
+                errors = name + ERR_SUFFIX
+                result[errors] = err + result[errors] if errors in result.columns else err
+        return result
+
+    def finish(self, partial):
+        if self.aggregations is not None:
+            result = pd.DataFrame(index=partial.index)
+            for position, aggregation in enumerate(self.aggregations):
+                prefix = f"{position}\0"
+                states = {name[len(prefix):]: partial[name] for name in partial.columns if name.startswith(prefix)}
+                result[aggregation.name] = aggregation.finish(states)
+            return result.reset_index()
+        errors = [name for name in partial.columns if name.endswith(ERR_SUFFIX)]
+        totals = {name[:-len(ERR_SUFFIX)]: partial[name[:-len(ERR_SUFFIX)]] + partial[name] for name in errors}
+        return partial.assign(**totals).drop(columns=errors).reset_index()
+
+    def describe(self):
+        text = f"GROUP_BY {', '.join(self.keys)}"
+        if self.aggregations is not None:
+            text += f" AGG {', '.join(str(aggregation) for aggregation in self.aggregations)}"
+        return text
+
+
+@dataclass
+class Join:
+    path: str
+    key: str
+    how: str = 'inner'
+    read_csv: object = field(default=pd.read_csv, repr=False, compare=False)
+    strategy: str = field(default=None, compare=False)
+
+    @property
+    def columns(self):
+        # O resultado traz todas as colunas da esquerda
+        return None
+
+    def apply(self, df):
+        right, index = load_indexed(self.path, self.key, self.read_csv)
+        result, self.strategy = join_frames(df, right, self.key, self.how, index)
+        return result
+
+    def stream_strategy(self, memory_budget):
+        '''Estratégia no modo STREAM: broadcast se a tabela da direita cabe na memória.
+
+        RIGHT e OUTER precisam saber quais linhas da direita nunca tiveram par em
+        nenhum bloco, então sempre usam o join particionado.'''
+        if self.how in ('inner', 'left') and estimate_bytes(self.path) <= memory_budget:
+            return 'broadcast'
+        return 'partitioned'
+
+    def describe(self):
+        strategy = f" estratégia={self.strategy}" if self.strategy else ''
+        return f"JOIN '{self.path}' ON {self.key} ({self.how.upper()}){strategy}"
+
+
+@dataclass
+class Plan:
+    'Plano lógico: uma origem seguida das operações na ordem em que foram digitadas.'
+    scan: Scan
+    steps: list = field(default_factory=list)
+
+    def add(self, step):
+        self.steps.append(step)
+
+    def describe(self):
+        return [self.scan.describe()] + [step.describe() for step in self.steps]
+
+
+def optimize(plan):
+    '''Devolve um novo plano com os filtros e a projeção empurrados para o SCAN.
+
+    Filtros só podem passar por SELECT e SORT_BY; REMOVE_DUPLICATES, UPDATE e
+    GROUP_BY mudam quais linhas ou valores o filtro enxergaria. Um filtro sobre
+    uma coluna que o SELECT anterior descartou fica no lugar, para falhar como
+    no modo EAGER.'''
+    pushed = []
+    steps = []
+    blocked = False
+    # Colunas que restam depois dos SELECTs já vistos (None: todas)
+    available = None
+    for step in plan.steps:
+        if isinstance(step, Filter) and available is not None and not step.columns <= available:
+            blocked = True
+        if not isinstance(step, (Filter, Select, Sort)):
+            blocked = True
+        if isinstance(step, Filter) and not blocked:
+            pushed.append(step.condition)
+        else:
+            steps.append(step)
+        if isinstance(step, Select):
+            available = set(step.names) if available is None else available & set(step.names)
+
+    # Filtros restantes que ficaram lado a lado viram uma única máscara
+    merged = []
+    for step in steps:
+        if isinstance(step, Filter) and merged and isinstance(merged[-1], Filter):
+            merged[-1] = Filter(combine([merged[-1].condition, step.condition]))
+        else:
+            merged.append(step)
+
+    # Projeção: só as colunas usadas depois do SCAN precisam ser lidas
+    needed = None
+    for step in reversed(merged):
+        if isinstance(step, Select):
+            needed = set(step.names)
+        elif isinstance(step, GroupBy) and step.aggregations is not None:
+            # O resultado só tem chaves e agregações: antes dele bastam as colunas que elas usam
+            needed = set(step.columns)
+        elif needed is not None:
+            columns = step.columns
+            needed = None if columns is None else needed | columns
+
+    condition = plan.scan.condition
+    if pushed:
+        condition = combine(([condition] if condition is not None else []) + pushed)
+    usecols = plan.scan.usecols
+    if needed is not None:
+        if condition is not None:
+            needed |= condition.columns
+        usecols = sorted(needed) if usecols is None else [c for c in usecols if c in needed]
+
+    return Plan(Scan(plan.scan.source, usecols, condition, plan.scan.compact), merged)
+
+
+def _restrict(scan, df):
+    if scan.condition is not None:
+        df = df[scan.condition.mask(df)]
+    if scan.usecols is not None and not isinstance(scan.source, str):
+        df = df[[c for c in df.columns if c in scan.usecols]]
+    return df
+
+
+def iter_scan(scan, chunksize, read_csv=read_csv):
+    '''Lê a origem em blocos de até chunksize linhas, já filtrados.
+
+    Sempre produz ao menos um bloco (possivelmente vazio) para que as colunas
+    do resultado sejam conhecidas mesmo sem nenhuma linha.'''
+    if isinstance(scan.source, str):
+        chunks = read_csv(scan.source, usecols=scan.usecols, chunksize=chunksize, **scan.options)
+    else:
+        df = scan.source
+        # Cópias, pois UPDATE altera os blocos e o plano pode ser executado de novo
+        chunks = (df.iloc[start:start + chunksize].copy() for start in range(0, len(df), chunksize))
+
+    produced = False
+    for chunk in chunks:
+        produced = True
+        yield _restrict(scan, chunk)
+    if not produced:
+        if isinstance(scan.source, str):
+            yield read_csv(scan.source, usecols=scan.usecols, nrows=0, **scan.options)
+        else:
+            yield _restrict(scan, scan.source)
+
+
+def read_scan(scan, read_csv=read_csv):
+    'Executa o SCAN, aplicando o filtro a cada bloco lido do arquivo.'
+    if isinstance(scan.source, str) and scan.condition is None:
+        return read_csv(scan.source, usecols=scan.usecols, **scan.options)
+    if not isinstance(scan.source, str):
+        return _restrict(scan, scan.source)
+    return concat_chunks(iter_scan(scan, SCAN_CHUNK_ROWS, read_csv))
+
+
+def check_columns(plan, read_csv=read_csv):
+    '''Roda o plano sobre zero linhas para acusar colunas inexistentes já ao adiar um passo.
+
+    Só KeyError (coluna que não existe) é propagado: os tipos vêm das primeiras
+    linhas do arquivo, então outros erros ficam para a execução de verdade.'''
+    scan = plan.scan
+    if isinstance(scan.source, str):
+        df = read_csv(scan.source, nrows=CHECK_ROWS, **scan.options).iloc[:0].copy()
+    else:
+        df = scan.source.iloc[:0].copy()
+    for step in plan.steps:
+        try:
+            if isinstance(step, Join):
+                # Só o cabeçalho da direita: o arquivo pode não caber na memória
+                right = step.read_csv(step.path, nrows=CHECK_ROWS).iloc[:0]
+                df = join_frames(df, right, step.key, step.how)[0]
+            else:
+                df = step.apply(df)
+        except KeyError:
+            raise
+        except Exception:
+            return
+
+
+def execute(plan, read_csv=read_csv):
+    'Otimiza e executa o plano, devolvendo o DataFrame resultante.'
+    plan = optimize(plan)
+    df = read_scan(plan.scan, read_csv)
+    for step in plan.steps:
+        df = step.apply(df)
+    return df
@@ -0,0 +1,93 @@
+import json
+import time
+from contextlib import contextmanager
+
+
+def io_counters():
+    'Bytes lidos e gravados pelo processo até agora (rchar/wchar do Linux), ou None se não houver.'
+    try:
+        with open('/proc/self/io', encoding='ascii') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _status(field):
+    'Valor em bytes de um campo de /proc/self/status (VmRSS, VmHWM), ou None.'
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def reset_peak_rss():
+    'Zera o pico de memória residente (VmHWM) do processo; devolve False se o sistema não permitir.'
+    try:
+        with open('/proc/self/clear_refs', 'w', encoding='ascii') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class Profiler:
+    '''Mede cada comando executado com PROFILE ON.
+
+    Para cada comando guarda o tempo de relógio, as linhas antes e depois, o
+    pico de memória residente acima do que o processo já usava e os bytes lidos
+    e gravados pelo processo. Memória e bytes vêm do /proc do Linux, sem custo
+    durante o comando; em outros sistemas ficam como None.'''
+
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+
+    def start(self):
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def clear(self):
+        self.records = []
+
+    @contextmanager
+    def measure(self, command, rows):
+        'Mede o bloco como um comando; rows() devolve as linhas dos dados atuais ou None.'
+        record = {'command': command, 'ok': True, 'rows_in': rows()}
+        io_before = io_counters()
+        tracked = reset_peak_rss()
+        baseline = _status('VmRSS')
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(time.perf_counter() - started, 6)
+            record['rows_out'] = rows()
+            peak = _status('VmHWM') if tracked else None
+            record['peak_memory'] = max(peak - baseline, 0) if peak is not None and baseline is not None else None
+            io_after = io_counters()
+            if io_before is not None and io_after is not None:
+                record['bytes_read'] = io_after[0] - io_before[0]
+                record['bytes_written'] = io_after[1] - io_before[1]
+            else:
+                record['bytes_read'] = record['bytes_written'] = None
+            self.records.append(record)
+
+    def totals(self):
+        return {
+            'seconds': round(sum(r['seconds'] for r in self.records), 6),
+            'peak_memory': max((r['peak_memory'] or 0 for r in self.records), default=0),
+            'bytes_read': sum(r['bytes_read'] or 0 for r in self.records),
+            'bytes_written': sum(r['bytes_written'] or 0 for r in self.records),
+        }
+
+    def dump(self, path):
+        'Grava o rastro em JSON: uma entrada por comando, na ordem em que rodaram, e os totais.'
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'commands': self.records, 'totals': self.totals()}, f, ensure_ascii=False, indent=2)
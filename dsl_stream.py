@@ -0,0 +1,196 @@
+import numpy as np
+
+from dsl_cache import DEFAULT_MEMORY_BUDGET
+from dsl_join import PartitionedJoin, partition_count
+from dsl_plan import Dedupe, GroupBy, Join, Sort, iter_scan, optimize
+from dsl_types import concat_chunks, json_ready
+
+
+# Tamanho padrão dos blocos no modo STREAM
+DEFAULT_CHUNK_ROWS = 100_000
+
+# Quantas agregações parciais acumular antes de combiná-las
+MAX_PENDING_PARTIALS = 16
+
+# Chave usada no lugar de NaN no conjunto de valores já vistos
+_NA_KEY = object()
+
+
+class StreamPipeline:
+    '''Aplica os passos de um plano bloco a bloco.
+
+    Os passos linha a linha (FILTER, SELECT, UPDATE, REMOVE_DUPLICATES e JOIN
+    com broadcast) rodam em cada bloco. O primeiro passo bloqueante interrompe
+    o fluxo: o GROUP_BY guarda só agregações parciais, o SORT_BY acumula os
+    blocos e o JOIN particionado espalha os blocos em disco. A saída dele
+    alimenta um novo pipeline com os passos restantes.'''
+
+    def __init__(self, steps, chunksize=DEFAULT_CHUNK_ROWS, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.chunksize = chunksize
+        self.memory_budget = memory_budget
+        steps = list(steps)
+        cut = next((i for i, step in enumerate(steps) if self._blocks(step)), len(steps))
+        self.row_steps = steps[:cut]
+        self.blocking = steps[cut] if cut < len(steps) else None
+        self.tail = steps[cut + 1:]
+        self.seen = {}
+        self.pending = []
+        self.spill = None
+        if isinstance(self.blocking, Join):
+            self.blocking.strategy = 'partitioned'
+            self.spill = PartitionedJoin(self.blocking.path, self.blocking.key, self.blocking.how,
+                                         partition_count(self.blocking.path, memory_budget), chunksize)
+
+    def _blocks(self, step):
+        if isinstance(step, Join):
+            step.strategy = step.stream_strategy(self.memory_budget)
+            return step.strategy == 'partitioned'
+        return isinstance(step, (GroupBy, Sort))
+
+    def feed(self, chunk):
+        'Processa um bloco; devolve o bloco de saída ou None se o passo bloqueante o absorveu.'
+        for index, step in enumerate(self.row_steps):
+            if isinstance(step, Dedupe):
+                chunk = self._dedupe(index, step.column, chunk)
+            elif isinstance(step, Join):
+                chunk = step.apply(chunk)
+                step.strategy = 'broadcast'
+            else:
+                chunk = step.apply(chunk)
+
+        if self.blocking is None:
+            return chunk
+        if isinstance(self.blocking, GroupBy):
+            self.pending.append(self.blocking.partial(chunk))
+            if len(self.pending) > MAX_PENDING_PARTIALS:
+                self.pending = [self.blocking.combine(self.pending)]
+        elif self.spill is not None:
+            self.spill.add(chunk)
+        else:
+            self.pending.append(chunk)
+        return None
+
+    def finish(self):
+        'Produz os blocos restantes: a saída do passo bloqueante passada pelos passos seguintes.'
+        if self.blocking is None:
+            return
+        # O estado acumulado é mantido (compactado em um só item) para que as views
+        # materializadas possam continuar alimentando o pipeline depois
+        if isinstance(self.blocking, GroupBy):
+            self.pending = [self.blocking.combine(self.pending)]
+            chunks = [self.blocking.finish(self.pending[0])]
+        elif self.spill is not None:
+            chunks = self.spill.results()
+        else:
+            self.pending = [concat_chunks(self.pending)]
+            chunks = [self.blocking.apply(self.pending[0])]
+
+        tail = StreamPipeline(self.tail, self.chunksize, self.memory_budget)
+        for chunk in chunks:
+            out = tail.feed(chunk)
+            if out is not None:
+                yield out
+        yield from tail.finish()
+
+    def _dedupe(self, index, column, chunk):
+        seen = self.seen.setdefault(index, set())
+        chunk = chunk.drop_duplicates(subset=column)
+        values = chunk[column]
+        keys = [_NA_KEY if missing else key for key, missing in zip(values.tolist(), values.isna().tolist())]
+        keep = np.array([key not in seen for key in keys], dtype=bool)
+        seen.update(keys)
+        return chunk[keep]
+
+
+def run_stream(plan, chunksize=DEFAULT_CHUNK_ROWS, memory_budget=DEFAULT_MEMORY_BUDGET):
+    'Executa o plano em blocos, produzindo os blocos do resultado.'
+    plan = optimize(plan)
+    pipeline = StreamPipeline(plan.steps, chunksize, memory_budget)
+    for chunk in iter_scan(plan.scan, chunksize):
+        out = pipeline.feed(chunk)
+        if out is not None:
+            yield out
+    yield from pipeline.finish()
+
+
+def collect(chunks):
+    return concat_chunks(chunks)
+
+
+def _typed(chunks, dtypes, seen):
+    'Converte os blocos para os tipos dados e anota em "seen" os tipos de cada coluna.'
+    for chunk in chunks:
+        if dtypes:
+            chunk = chunk.astype({name: dtype for name, dtype in dtypes.items() if name in chunk.columns})
+        if len(chunk):
+            for name in chunk.columns:
+                seen.setdefault(name, set()).add(chunk[name].dtype)
+        yield chunk
+
+
+def mixed_numbers(seen):
+    '''Colunas que foram inteiras em alguns blocos e float em outros, com o tipo comum.
+
+    Lido de uma vez, o pandas faria a coluna inteira float (um NaN basta), e o
+    "1" de um bloco sairia "1.0"; o tipo comum é o mesmo que o pd.concat usaria.'''
+    mixed = {}
+    for name, dtypes in seen.items():
+        if not all(isinstance(dtype, np.dtype) for dtype in dtypes):
+            continue
+        kinds = {dtype.kind for dtype in dtypes}
+        if 'f' in kinds and kinds & {'i', 'u'} and kinds <= {'i', 'u', 'f'}:
+            mixed[name] = np.result_type(*dtypes)
+    return mixed
+
+
+def write_csv(chunks, path, dtypes=None):
+    '''Grava os blocos em CSV, escrevendo o cabeçalho só no primeiro.
+
+    Devolve as colunas que saíram com tipos numéricos diferentes entre blocos
+    (veja mixed_numbers); write_stream grava de novo com esses tipos.'''
+    seen = {}
+    first = True
+    for chunk in _typed(chunks, dtypes, seen):
+        chunk.to_csv(path, index=False, mode='w' if first else 'a', header=first)
+        first = False
+    return mixed_numbers(seen)
+
+
+def write_json(chunks, path, lines=False, dtypes=None):
+    '''Grava os blocos em JSON: um array de registros ou, com lines=True, NDJSON.
+
+    O array é montado a partir do to_json de cada bloco, então o arquivo fica
+    idêntico ao gerado de uma vez por DataFrame.to_json(orient='records').
+    Devolve as colunas com tipos diferentes entre blocos, como write_csv.'''
+    seen = {}
+    with open(path, 'w', encoding='utf-8') as f:
+        chunks = (json_ready(chunk) for chunk in _typed(chunks, dtypes, seen))
+        if lines:
+            wrote = False
+            for chunk in chunks:
+                if len(chunk):
+                    f.write(chunk.to_json(orient='records', lines=True))
+                    wrote = True
+            if not wrote:
+                f.write('\n')
+            return mixed_numbers(seen)
+        f.write('[')
+        wrote = False
+        for chunk in chunks:
+            body = chunk.to_json(orient='records')[1:-1]
+            if body:
+                f.write((',' if wrote else '') + body)
+                wrote = True
+        f.write(']')
+    return mixed_numbers(seen)
+
+
+def write_stream(write, produce, path, **options):
+    '''Grava os blocos de produce() com write (write_csv ou write_json).
+
+    Se alguma coluna numérica veio inteira em uns blocos e float em outros, o
+    plano roda de novo e a saída é regravada já com o tipo comum, como no modo
+    normal. Isso só custa uma segunda leitura quando acontece.'''
+    dtypes = write(produce(), path, **options)
+    if dtypes:
+        write(produce(), path, dtypes=dtypes, **options)
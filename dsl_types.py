@@ -0,0 +1,142 @@
+import re
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+# Linhas lidas para decidir os tipos das colunas
+SAMPLE_ROWS = 10_000
+
+# Texto vira categoria quando tem no máximo essa fração de valores distintos na amostra
+CATEGORY_MAX_RATIO = 0.5
+
+# Blocos em que o arquivo é lido no modo compacto
+COMPACT_CHUNK_ROWS = 500_000
+
+DATE_FORMAT = '%Y-%m-%d'
+_DATE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+
+def infer_types(sample):
+    '''Decide, pela amostra, quais colunas de texto viram categoria e quais viram data.
+
+    Só datas no formato AAAA-MM-DD são convertidas, para que SAVE grave
+    exatamente o mesmo texto que estava no arquivo.'''
+    categories, dates = [], []
+    for name in sample.columns:
+        series = sample[name]
+        if not (pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype)):
+            continue
+        values = series.dropna()
+        if not len(values) or not values.map(lambda v: isinstance(v, str)).all():
+            continue
+        if values.str.fullmatch(_DATE.pattern).all():
+            dates.append(name)
+        elif values.nunique() <= CATEGORY_MAX_RATIO * len(values):
+            categories.append(name)
+    return categories, dates
+
+
+def narrow(chunk):
+    '''Reduz os números de um bloco ao menor tipo que guarda todos os valores sem perda.
+
+    Inteiros usam o menor inteiro com sinal que cabe; float32 só é usado se
+    nenhum valor mudar na conversão.'''
+    for name in chunk.columns:
+        dtype = chunk[name].dtype
+        if not isinstance(dtype, np.dtype):
+            continue
+        if dtype.kind == 'i':
+            chunk[name] = pd.to_numeric(chunk[name], downcast='integer')
+        elif dtype.kind == 'f' and dtype.itemsize > 4:
+            small = chunk[name].astype('float32')
+            if np.array_equal(small.to_numpy(dtype='float64'), chunk[name].to_numpy(), equal_nan=True):
+                chunk[name] = small
+    return chunk
+
+
+def read_compact(path, usecols=None, chunksize=None, nrows=None, **options):
+    '''Lê o CSV com tipos compactos: categorias, datas e números reduzidos.
+
+    Categorias e datas são passadas ao parser, que já as constrói sem criar
+    o texto completo. Inteiros e floats não podem ir reduzidos para o parser
+    (valores fora da faixa seriam truncados sem aviso), então são reduzidos a
+    cada bloco lido; só um bloco existe com os tipos largos por vez.'''
+    sample = pd.read_csv(path, usecols=usecols, nrows=SAMPLE_ROWS, **options)
+    categories, dates = infer_types(sample)
+    chunks = pd.read_csv(path, usecols=usecols, nrows=nrows, chunksize=chunksize or COMPACT_CHUNK_ROWS,
+                         dtype={name: 'category' for name in categories},
+                         parse_dates=dates, date_format=DATE_FORMAT, **options)
+    chunks = (narrow(chunk) for chunk in chunks)
+    if chunksize is not None:
+        return chunks
+    chunks = list(chunks)
+    return concat_chunks(chunks) if chunks else narrow(sample)
+
+
+def read_csv(path, compact=False, **options):
+    'pd.read_csv com a opção compact=True, que usa read_compact.'
+    if compact:
+        return read_compact(path, **options)
+    return pd.read_csv(path, **options)
+
+
+def concat_chunks(chunks):
+    '''pd.concat que mantém os tipos compactos.
+
+    Blocos lidos separadamente têm categorias diferentes, e o pd.concat os
+    transformaria em texto comum; aqui as categorias são unificadas. Uma coluna
+    que virou data em alguns blocos e não em outros volta a ser texto.'''
+    chunks = list(chunks)
+    if len(chunks) == 1:
+        return chunks[0]
+    for name in chunks[0].columns:
+        columns = [chunk[name] for chunk in chunks]
+        if all(isinstance(column.dtype, pd.CategoricalDtype) for column in columns):
+            dtype = pd.CategoricalDtype(union_categoricals(columns, sort_categories=True).categories)
+            chunks = [chunk.astype({name: dtype}) for chunk in chunks]
+        elif any(column.dtype.kind == 'M' for column in columns) and \
+                not all(column.dtype.kind == 'M' for column in columns):
+            chunks = [chunk.assign(**{name: chunk[name].dt.strftime(DATE_FORMAT)})
+                      if chunk[name].dtype.kind == 'M' else chunk for chunk in chunks]
+    return pd.concat(chunks)
+
+
+def widen(series, dates_as_text=False):
+    '''Volta a coluna ao tipo que o pandas usaria sem o modo compacto.
+
+    Usado antes de somas e contas, que estourariam em inteiros pequenos, e para
+    medir a memória "antes" no comando MEMORY (com dates_as_text=True).'''
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return series.astype(dtype.categories.dtype)
+    if not isinstance(dtype, np.dtype):
+        return series
+    if dtype.kind == 'i' and dtype.itemsize < 8:
+        return series.astype('int64')
+    if dtype.kind == 'f' and dtype.itemsize < 8:
+        return series.astype('float64')
+    if dtype.kind == 'M' and dates_as_text:
+        return series.dt.strftime(DATE_FORMAT).astype('str')
+    return series
+
+
+def json_ready(df):
+    'Datas viram texto AAAA-MM-DD no JSON, como estavam no arquivo, em vez de milissegundos.'
+    dates = [name for name in df.columns if df[name].dtype.kind == 'M']
+    if not dates:
+        return df
+    return df.assign(**{name: df[name].dt.strftime(DATE_FORMAT) for name in dates})
+
+
+def memory_report(df):
+    'Para cada coluna: (nome, tipo padrão, tipo atual, bytes com o tipo padrão, bytes atuais).'
+    rows = []
+    for name in df.columns:
+        series = df[name]
+        default = widen(series, dates_as_text=True)
+        rows.append((name, str(default.dtype), str(series.dtype),
+                     int(default.memory_usage(index=False, deep=True)),
+                     int(series.memory_usage(index=False, deep=True))))
+    return rows
@@ -0,0 +1,269 @@
+import csv
+import hashlib
+import io
+import os
+import pickle
+from dataclasses import replace
+
+import pandas as pd
+
+from dsl_join import _signature
+from dsl_plan import Join, _restrict, optimize
+from dsl_stream import DEFAULT_CHUNK_ROWS, StreamPipeline, mixed_numbers, write_csv
+from dsl_types import read_csv
+
+
+DEFAULT_DIRECTORY = '.dsl_views'
+
+# Bytes do início do arquivo e do fim da parte já processada usados para detectar reescritas
+FINGERPRINT_BYTES = 64 * 1024
+
+
+class _Range(io.RawIOBase):
+    'Lê no máximo "length" bytes de um arquivo já posicionado.'
+
+    def __init__(self, f, length):
+        self.f = f
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.remaining)
+        if size <= 0:
+            return 0
+        data = self.f.read(size)
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+
+def _digest(f, start, stop):
+    f.seek(start)
+    return hashlib.sha1(f.read(max(stop - start, 0))).hexdigest()
+
+
+def _byte(f, position):
+    f.seek(position)
+    return f.read(1)
+
+
+class _Widened(Exception):
+    'Uma coluna numérica já gravada como inteira passou a ter floats: a saída precisa ser refeita.'
+
+    def __init__(self, dtypes):
+        super().__init__(dtypes)
+        self.dtypes = dtypes
+
+
+class MaterializedView:
+    '''Resultado de um plano guardado junto com o ponto até onde o CSV foi lido.
+
+    O plano roda como no modo STREAM, e o StreamPipeline inteiro (valores já
+    vistos pelo REMOVE_DUPLICATES, agregações parciais do GROUP_BY, linhas
+    acumuladas para o SORT_BY) é gravado em disco. O REFRESH lê só as linhas
+    acrescentadas depois do último byte processado e continua alimentando o
+    mesmo pipeline. Se o início do arquivo, o trecho já processado ou algum
+    arquivo de JOIN mudou, ou se uma coluna já gravada como inteira passou a
+    ter floats, a view é reconstruída do zero.'''
+
+    def __init__(self, name, plan, output, directory=DEFAULT_DIRECTORY, chunksize=DEFAULT_CHUNK_ROWS):
+        if not isinstance(plan.scan.source, str):
+            raise ValueError("a view precisa de um plano que comece com LOAD de um arquivo")
+        self.name = name
+        self.output = output
+        self.directory = directory
+        self.chunksize = chunksize
+        # Joins leem o arquivo da direita com o leitor padrão, que pode ser gravado junto com a view
+        steps = [replace(step, read_csv=read_csv) if isinstance(step, Join) else step for step in plan.steps]
+        self.plan = optimize(replace(plan, steps=steps))
+        self.source = self.plan.scan.source
+        if os.path.abspath(output) == os.path.abspath(self.source):
+            raise ValueError(f"a saída '{output}' não pode ser o próprio arquivo de origem")
+        self._reset()
+
+    def _reset(self):
+        # Memória ilimitada: JOIN INNER/LEFT sempre por broadcast, que funciona bloco a bloco
+        self.pipeline = StreamPipeline(self.plan.steps, self.chunksize, memory_budget=float('inf'))
+        self.columns = None
+        self.header_end = 0
+        self.offset = 0
+        self.rows = 0
+        self.output_rows = 0
+        # Tipo de cada coluna já gravada na saída (sem passo bloqueante)
+        self.dtypes = {}
+        self.head_hash = self.tail_hash = None
+        self.joins = {step.path: _signature(step.path) for step in self.plan.steps if isinstance(step, Join)}
+
+    @property
+    def incremental(self):
+        '''JOIN RIGHT/OUTER antes do primeiro passo bloqueante vira join particionado: as linhas
+        da direita sem par dependem do arquivo todo, então a view sempre é reconstruída.'''
+        return self.pipeline.spill is None
+
+    # Leitura do CSV
+    def _changed(self, f, size):
+        if size < self.offset:
+            return True
+        head = min(FINGERPRINT_BYTES, self.offset)
+        if _digest(f, 0, head) != self.head_hash:
+            return True
+        if _digest(f, max(self.offset - FINGERPRINT_BYTES, 0), self.offset) != self.tail_hash:
+            return True
+        if size > self.offset > self.header_end and _byte(f, self.offset - 1) != b'\n' \
+                and _byte(f, self.offset) not in (b'\n', b'\r'):
+            # A última linha foi lida sem quebra de linha e depois continuou a ser escrita
+            return True
+        return any(_signature(path) != signature for path, signature in self.joins.items())
+
+    def _read_header(self, f):
+        f.seek(0)
+        line = f.readline()
+        self.header_end = len(line)
+        self.columns = next(csv.reader([line.decode('utf-8-sig')]), [])
+
+    def _chunks(self, f, start, stop):
+        'Lê as linhas entre os bytes start e stop, em blocos, já com o SCAN aplicado.'
+        if stop <= start:
+            return
+        f.seek(start)
+        reader = io.BufferedReader(_Range(f, stop - start))
+        for chunk in pd.read_csv(reader, header=None, names=self.columns, usecols=self.plan.scan.usecols,
+                                 chunksize=self.chunksize):
+            self.rows += len(chunk)
+            yield _restrict(self.plan.scan, chunk)
+
+    def _typed(self, out):
+        '''Converte o bloco de saída para os tipos já gravados.
+
+        Um float numa coluna que já saiu inteira não cabe: levanta _Widened com
+        os tipos que a saída inteira precisa ter.'''
+        if not len(out):
+            return out
+        casts, widened = {}, {}
+        for name in out.columns:
+            recorded = self.dtypes.setdefault(name, out[name].dtype)
+            if out[name].dtype == recorded:
+                continue
+            common = mixed_numbers({name: {recorded, out[name].dtype}}).get(name)
+            if common is None:
+                continue
+            if common == recorded:
+                casts[name] = recorded
+            else:
+                widened[name] = common
+        if widened:
+            raise _Widened({**self.dtypes, **widened})
+        return out.astype(casts) if casts else out
+
+    def _feed(self, f, start, stop, append):
+        'Passa o trecho pelo pipeline; sem passo bloqueante, as linhas já vão direto para a saída.'
+        fed = False
+        for chunk in self._chunks(f, start, stop):
+            fed = True
+            out = self.pipeline.feed(chunk)
+            if out is not None:
+                out = self._typed(out)
+                out.to_csv(self.output, index=False, mode='a' if append else 'w', header=not append)
+                self.output_rows += len(out)
+                append = True
+        if not fed and not append:
+            # Nenhuma linha: ainda assim a saída precisa do cabeçalho
+            columns = self.plan.scan.usecols or self.columns
+            empty = _restrict(self.plan.scan, pd.DataFrame({name: [] for name in self.columns if name in columns}))
+            out = self.pipeline.feed(empty)
+            if out is not None:
+                out.to_csv(self.output, index=False)
+
+    def _write_result(self):
+        if self.pipeline.blocking is None:
+            return
+        rows = [0]
+
+        def counted(chunks):
+            for chunk in chunks:
+                rows[0] += len(chunk)
+                yield chunk
+
+        write_csv(counted(self.pipeline.finish()), self.output)
+        self.output_rows = rows[0]
+
+    # Operações
+    def build(self, dtypes=None):
+        '''Processa o arquivo inteiro e grava a saída.
+
+        Se uma coluna da saída muda de inteira para float no meio do arquivo, a
+        leitura recomeça com o tipo float desde o primeiro bloco.'''
+        while True:
+            self._reset()
+            self.dtypes = dict(dtypes or {})
+            try:
+                with open(self.source, 'rb') as f:
+                    size = os.fstat(f.fileno()).st_size
+                    self._read_header(f)
+                    self._feed(f, self.header_end, max(size, self.header_end), append=False)
+                    self._mark(f, max(size, self.header_end))
+            except _Widened as e:
+                dtypes = e.dtypes
+                continue
+            self._write_result()
+            return {'tipo': 'completa', 'linhas_lidas': self.rows, 'linhas_resultado': self.output_rows}
+
+    def refresh(self):
+        'Processa só as linhas novas; se o arquivo foi reescrito (ou o plano não permite), reconstrói.'
+        dtypes = None
+        with open(self.source, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if not self.incremental:
+                rebuild = 'completa'
+            elif self._changed(f, size):
+                rebuild = 'completa (arquivo alterado)'
+            else:
+                rebuild = None
+                before = self.rows
+                if size == self.offset:
+                    return {'tipo': 'sem novidades', 'linhas_lidas': 0, 'linhas_resultado': self.output_rows}
+                try:
+                    self._feed(f, self.offset, size, append=True)
+                except _Widened as e:
+                    # A saída já tem a coluna como inteira: refeita com o tipo float
+                    rebuild, dtypes = 'completa (tipos mudaram)', e.dtypes
+                except (ValueError, TypeError):
+                    # Linhas novas que não combinam com os tipos já vistos: mais seguro reconstruir
+                    rebuild = 'completa (tipos mudaram)'
+                else:
+                    self._mark(f, size)
+        if rebuild:
+            result = self.build(dtypes)
+            result['tipo'] = rebuild
+            return result
+        self._write_result()
+        return {'tipo': 'incremental', 'linhas_lidas': self.rows - before, 'linhas_resultado': self.output_rows}
+
+    def _mark(self, f, end):
+        self.offset = end
+        self.head_hash = _digest(f, 0, min(FINGERPRINT_BYTES, end))
+        self.tail_hash = _digest(f, max(end - FINGERPRINT_BYTES, 0), end)
+
+    # Persistência
+    @staticmethod
+    def path(name, directory=DEFAULT_DIRECTORY):
+        safe = hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(directory, f"{safe}.pkl")
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(self.name, self.directory)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, name, directory=DEFAULT_DIRECTORY):
+        path = cls.path(name, directory)
+        if not os.path.exists(path):
+            raise KeyError(f"View '{name}' não encontrada. Use MATERIALIZE primeiro.")
+        with open(path, 'rb') as f:
+            return pickle.load(f)
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from dsl_join import PartitionedJoin
+
+
+def _sorted(df):
+    return df.sort_values(list(df.columns), na_position='last', kind='stable').reset_index(drop=True)
+
+
+@pytest.mark.parametrize('how', ['inner', 'left', 'right', 'outer'])
+def test_partitioned_join_with_different_key_dtypes(tmp_path, how):
+    'Chaves float64 (com vazio) e int8 à esquerda contra int64 à direita caem nas mesmas partições.'
+    right = pd.DataFrame({'k': [1, 2, 4, -3, 0], 'b': ['p', 'q', 'r', 's', 't']})
+    path = tmp_path / 'r.csv'
+    right.to_csv(path, index=False)
+    chunks = [
+        pd.DataFrame({'k': [1.0, np.nan, 2.0, 3.0], 'a': ['x', 'y', 'z', 'w']}),
+        pd.DataFrame({'k': np.array([-3, 4, 0], dtype='int8'), 'a': ['u', 'v', 'o']}, index=[4, 5, 6]),
+        pd.DataFrame({'k': [-0.0], 'a': ['m']}, index=[7]),
+    ]
+
+    join = PartitionedJoin(str(path), 'k', how, partitions=8, chunksize=2)
+    for chunk in chunks:
+        join.add(chunk)
+    results = list(join.results())
+
+    result = pd.concat(results)
+    expected = pd.merge(pd.concat(chunks), right, on='k', how=how)
+    assert result.index.equals(pd.RangeIndex(len(expected)))
+    pd.testing.assert_frame_equal(_sorted(result), _sorted(expected), check_dtype=False)